@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from pipeline import bucket_codes, bucket_sums, codes_to_timestamps, command_modules, mock_scales, resample_mean_of_means
+
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+pollutant_columns = ['PM10', 'TRS', 'O3', 'NO2', 'CO', 'PM2.5', 'SO2', 'Benzene', 'Toluene']
+
+
+# Synthetic hourly readings for several stations and years, already renamed to the standard columns
+def synthetic_pollution_data(stations=20, years=6, missing=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range(start='2013-01-01', periods=years * 365 * 24, freq='h')
+    rows = len(hours) * stations
+    df = pd.DataFrame({
+        'Date': np.tile(hours, stations),
+        'ID': np.repeat(np.arange(1, stations + 1), len(hours))
+    })
+    for column in pollutant_columns:
+        values = rng.gamma(2.0, 10.0, rows).round(1)
+        values[rng.random(rows) < missing] = np.nan
+        df[column] = values
+    return df
+
+
+# Synthetic deforestation alerts with parsed dates, sorted by date as clean_deforestation_data does before aggregating
+def synthetic_deforestation_data(rows=2000000, years=6, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Date': pd.Timestamp('2013-01-01') + pd.to_timedelta(rng.integers(0, years * 365 * 24, rows), unit='h'),
+        'AffectedArea': rng.uniform(5, 2000, rows)
+    })
+    return df.sort_values(by='Date', ignore_index=True)
+
+
+# Previous implementation: two groupby passes over PeriodIndex keys
+def pandas_mean_of_means(df):
+    df = df[['Date'] + pollutant_columns]
+    df = df.groupby(df['Date'].dt.to_period('D')).mean(numeric_only=True).reset_index()
+    df['Date'] = df['Date'].dt.to_timestamp()
+    df = df.groupby(df['Date'].dt.to_period('M')).mean(numeric_only=True).reset_index()
+    df['Date'] = df['Date'].dt.to_timestamp()
+    return df
+
+
+def engine_mean_of_means(df):
+    month_codes, monthly_means = resample_mean_of_means(df['Date'], [df[column] for column in pollutant_columns])
+    result = pd.DataFrame(monthly_means, columns=pollutant_columns)
+    result.insert(0, 'Date', codes_to_timestamps(month_codes, 'M'))
+    return result
+
+
+def pandas_monthly_sum(df):
+    df = df.groupby(df['Date'].dt.to_period('M')).agg({'AffectedArea': 'sum'}).reset_index()
+    df['Date'] = df['Date'].dt.to_timestamp()
+    return df
+
+
+def engine_monthly_sum(df):
+    month_codes, sums, _ = bucket_sums(bucket_codes(df['Date'], 'M'), df['AffectedArea'])
+    return pd.DataFrame({'Date': codes_to_timestamps(month_codes, 'M'), 'AffectedArea': sums[:, 0]})
+
+
+# Best wall time of several runs
+def best_of(func, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark_resampling(stations=20, years=6, repeat=3):
+    pollution = synthetic_pollution_data(stations=stations, years=years)
+    deforestation = synthetic_deforestation_data(years=years)
+    
+    # Both paths must produce the same monthly values before they are timed
+    expected, actual = pandas_mean_of_means(pollution), engine_mean_of_means(pollution)
+    assert (expected['Date'].values == actual['Date'].values).all()
+    assert np.allclose(expected[pollutant_columns].values, actual[pollutant_columns].values, equal_nan=True)
+    expected, actual = pandas_monthly_sum(deforestation), engine_monthly_sum(deforestation)
+    assert np.allclose(expected['AffectedArea'].values, actual['AffectedArea'].values)
+    
+    results = {
+        'pollution mean of daily means, pandas': best_of(pandas_mean_of_means, pollution, repeat=repeat),
+        'pollution mean of daily means, engine': best_of(engine_mean_of_means, pollution, repeat=repeat),
+        'deforestation monthly sum, pandas': best_of(pandas_monthly_sum, deforestation, repeat=repeat),
+        'deforestation monthly sum, engine': best_of(engine_monthly_sum, deforestation, repeat=repeat)
+    }
+    print(f"Resampling benchmark: {len(pollution)} hourly rows ({stations} stations, {years} years), "
+          f"{len(deforestation)} alerts")
+    for name, seconds in results.items():
+        print(f"  {name:<40} {seconds:8.3f}s")
+    pollution_speedup = results['pollution mean of daily means, pandas'] / results['pollution mean of daily means, engine']
+    deforestation_speedup = results['deforestation monthly sum, pandas'] / results['deforestation monthly sum, engine']
+    print(f"  speedup: pollution {pollution_speedup:.1f}x, deforestation {deforestation_speedup:.1f}x")
+    return results
+
+
+# Cold-start import time of pipeline.py plus each command's dependencies, each measured in a fresh interpreter
+def benchmark_imports(repeat=3):
+    script = ("import time; start = time.perf_counter(); import pipeline; "
+              "pipeline.import_command_modules(*{commands!r}); print(time.perf_counter() - start)")
+    cases = {'pipeline only': ()}
+    cases.update({command: (command,) for command in command_modules})
+    cases['everything (previous eager imports)'] = tuple(command_modules)
+    
+    results = {}
+    for name, commands in cases.items():
+        timings = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, '-c', script.format(commands=commands)], capture_output=True,
+                                    text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            timings.append(float(output.stdout.strip().splitlines()[-1]))
+        results[name] = min(timings)
+    
+    print("Import time per command (best of cold starts):")
+    for name, seconds in results.items():
+        print(f"  {name:<40} {seconds:8.3f}s")
+    return results
+
+
+# Run the mock pipeline at one scale in a scratch data directory, `repeat` times from a cold columnar store
+# and warehouse; the mock sources are generated once and reused. Returns the run log records of each run
+def run_pipeline_at_scale(scale, repeat=3, commands=(('load', '--grouped'), ('analyze',))):
+    data_dir = tempfile.mkdtemp(prefix=f'pipeline-benchmark-{scale}-')
+    env = dict(os.environ, USE_MOCK_DATA='true', MOCK_SCALE=scale, PIPELINE_DATA_DIR=data_dir, PIPELINE_HEADLESS='true')
+    env.pop('PIPELINE_RUN_LOG', None)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipeline.py')
+    log_path = os.path.join(data_dir, 'pipeline_runs.jsonl')
+    runs = []
+    try:
+        for _ in range(repeat):
+            shutil.rmtree(os.path.join(data_dir, 'columnar'), ignore_errors=True)
+            for name in ['warehouse.db', 'pipeline_runs.jsonl']:
+                if os.path.exists(os.path.join(data_dir, name)):
+                    os.remove(os.path.join(data_dir, name))
+            for command in commands:
+                subprocess.run([sys.executable, script, *command], env=env, check=True, capture_output=True, text=True)
+            with open(log_path) as f:
+                runs.append([json.loads(line) for line in f])
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return runs
+
+
+# Wall time, CPU time and peak RSS per stage name (stages called several times are summed within a run),
+# keeping the best run of each stage to damp scheduling noise; generating the mock data is setup, not a stage
+def summarize_stages(runs):
+    stages = {}
+    for records in runs:
+        totals = {}
+        for record in records:
+            if record['stage'] == 'create_mock_data':
+                continue
+            stage = totals.setdefault(record['stage'], {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_rss_bytes': 0})
+            stage['wall_seconds'] += record['wall_seconds']
+            stage['cpu_seconds'] += record['cpu_seconds']
+            stage['peak_rss_bytes'] = max(stage['peak_rss_bytes'], record['peak_rss_bytes'])
+        for name, metrics in totals.items():
+            best = stages.setdefault(name, metrics)
+            for key, value in metrics.items():
+                best[key] = min(best[key], value)
+    return stages
+
+
+# Stages slower or bigger than the baseline beyond the tolerance; small absolute slack keeps
+# millisecond stages from failing on noise. A stage without a baseline entry, or a baseline entry
+# whose stage no longer runs, also fails, so the baseline cannot silently fall behind the pipeline
+def find_regressions(results, baseline, tolerance=0.25, min_seconds=0.05, min_bytes=32 * 1024 ** 2):
+    regressions = []
+    for scale, stages in results.items():
+        for stage in sorted(set(baseline.get(scale, {})) - set(stages)):
+            regressions.append(f"{scale}/{stage}: in the baseline but did not run; update the baseline")
+        for stage, metrics in stages.items():
+            expected = baseline.get(scale, {}).get(stage)
+            if expected is None:
+                regressions.append(f"{scale}/{stage}: no baseline entry; update the baseline")
+                continue
+            if metrics['wall_seconds'] > expected['wall_seconds'] * (1 + tolerance) + min_seconds:
+                regressions.append(f"{scale}/{stage}: {metrics['wall_seconds']:.2f}s vs baseline {expected['wall_seconds']:.2f}s")
+            if metrics['peak_rss_bytes'] > expected['peak_rss_bytes'] * (1 + tolerance) + min_bytes:
+                regressions.append(f"{scale}/{stage}: peak RSS {metrics['peak_rss_bytes'] / 1024 ** 2:.0f} MiB "
+                                   f"vs baseline {expected['peak_rss_bytes'] / 1024 ** 2:.0f} MiB")
+    return regressions
+
+
+# Time and memory-profile every pipeline stage at several scale points and compare against the stored baseline
+def benchmark_pipeline(scales=('small', 'medium'), repeat=3, tolerance=0.25, update_baseline=False):
+    results = {}
+    for scale in scales:
+        start = time.perf_counter()
+        results[scale] = summarize_stages(run_pipeline_at_scale(scale, repeat=repeat))
+        print(f"Pipeline benchmark at scale '{scale}' ({mock_scales[scale]}), {time.perf_counter() - start:.1f}s total:")
+        for stage, metrics in sorted(results[scale].items(), key=lambda item: -item[1]['wall_seconds']):
+            print(f"  {stage:<36} {metrics['wall_seconds']:8.3f}s wall {metrics['cpu_seconds']:8.3f}s cpu "
+                  f"{metrics['peak_rss_bytes'] / 1024 ** 2:8.0f} MiB peak")
+    
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    if update_baseline:
+        baseline.update(results)
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline updated in {os.path.basename(baseline_path)}")
+        return []
+    
+    regressions = find_regressions(results, baseline, tolerance=tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the resampling engine against the pandas groupby path")
+    parser.add_argument('--stations', type=int, default=20)
+    parser.add_argument('--years', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--imports', action='store_true', help="measure cold-start import time per pipeline command")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="time and memory-profile each pipeline stage on mock data and compare with the baseline")
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=list(mock_scales))
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown or growth over the baseline")
+    parser.add_argument('--update-baseline', action='store_true', help="store these results as the new baseline")
+    args = parser.parse_args()
+    if args.imports:
+        benchmark_imports(repeat=args.repeat)
+    elif args.pipeline:
+        if benchmark_pipeline(scales=args.scales, repeat=args.repeat, tolerance=args.tolerance,
+                              update_baseline=args.update_baseline):
+            sys.exit(1)
+    else:
+        benchmark_resampling(stations=args.stations, years=args.years, repeat=args.repeat)
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+
+
+# Where clause terms the mock understands: the ones arcgis_queries builds plus simple equality
+date_term = re.compile(r"(\w+)\s*(>=|<)\s*DATE\s*'(\d{4}-\d{2}-\d{2})'")
+equal_term = re.compile(r"(\w+)\s*=\s*'([^']*)'")
+
+
+# Rows of the layer matching a where clause, or None when the clause uses anything else
+def filter_rows(layer, where):
+    mask = np.ones(len(layer), dtype=bool)
+    for term in re.split(r'\s+AND\s+', where.replace('(', '').replace(')', ''), flags=re.IGNORECASE):
+        term = term.strip()
+        if term in ('', '1=1'):
+            continue
+        match = date_term.fullmatch(term)
+        if match:
+            column, operator, value = match.groups()
+            dates = layer[f'{column}_parsed']
+            mask &= (dates >= pd.Timestamp(value)) if operator == '>=' else (dates < pd.Timestamp(value))
+            continue
+        match = equal_term.fullmatch(term)
+        if match and match.group(1) in layer.columns:
+            mask &= (layer[match.group(1)] == match.group(2)).to_numpy()
+            continue
+        return None
+    return layer[mask]
+
+
+# Answer /<layer>/query like an ArcGIS feature layer: returnCountOnly, resultOffset/resultRecordCount paging
+# capped at max_record_count (setting exceededTransferLimit), epoch-millisecond dates and X/Y centroids;
+# fail_every > 0 turns every n-th request into an HTTP 500 or an ArcGIS error payload
+def make_handler(layers, max_record_count, fail_every, stats):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with stats['lock']:
+                stats['requests'] += 1
+                stats['active'] += 1
+                stats['max_active'] = max(stats['max_active'], stats['active'])
+                number = stats['requests']
+            try:
+                self.respond(number)
+            finally:
+                with stats['lock']:
+                    stats['active'] -= 1
+
+        def respond(self, number):
+            url = urlsplit(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            layer = layers.get(url.path.rstrip('/').removesuffix('/query'))
+            if layer is None or not url.path.endswith('/query'):
+                return self.send_json({'error': {'code': 404, 'message': 'Layer not found'}}, status=404)
+            if fail_every and number % fail_every == 0:
+                if number % (2 * fail_every) == 0:
+                    return self.send_json({'error': {'code': 500, 'message': 'Mock server failure'}}, status=500)
+                return self.send_json({'error': {'code': 503, 'message': 'Mock service busy'}})
+
+            rows = filter_rows(layer, params.get('where', '1=1'))
+            if rows is None:
+                return self.send_json({'error': {'code': 400, 'message': 'Unable to perform query'}})
+            if params.get('returnCountOnly') == 'true':
+                return self.send_json({'count': len(rows)})
+
+            rows = rows.sort_values(params.get('orderByFields', 'objectid'), kind='stable')
+            offset = int(params.get('resultOffset', 0))
+            requested = int(params.get('resultRecordCount', max_record_count))
+            page = rows.iloc[offset:offset + min(requested, max_record_count)]
+            exceeded = offset + len(page) < len(rows) and requested > max_record_count
+            attributes = page.drop(columns=['X', 'Y', 'date_parsed']).astype(object).where(page.notna(), None)
+            features = [{'attributes': record, 'centroid': {'x': x, 'y': y}}
+                        for record, x, y in zip(attributes.to_dict('records'), page['X'], page['Y'])]
+            self.send_json({'features': features, 'exceededTransferLimit': exceeded})
+
+        def send_json(self, payload, status=200):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# A raw deforestation CSV served as a layer: dates as epoch milliseconds, as the query API returns them
+def load_layer(csv_path):
+    layer = pd.read_csv(csv_path)
+    layer['date_parsed'] = pd.to_datetime(layer['date'], format='%Y/%m/%d %H:%M:%S%z').dt.tz_localize(None)
+    milliseconds = layer['date_parsed'].astype('int64') // 10 ** 6
+    layer['date'] = milliseconds
+    layer['date_alias'] = milliseconds
+    return layer
+
+
+def start_server(layers, port=0, max_record_count=1000, fail_every=0):
+    stats = {'lock': threading.Lock(), 'requests': 0, 'active': 0, 'max_active': 0}
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(layers, max_record_count, fail_every, stats))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+# Fetch two mock layers through the pipeline's fetcher, with a page size above the server's maxRecordCount and
+# injected failures: the CSV as one layer (split by year, plus an overlapping query of the same layer) and every
+# third alert as a second layer renumbered onto the same objectids. The streamed CSV must hold exactly the alerts
+# of both layers, tagged with their layer, and pass the unique (layer, objectid) quality rule
+def self_test(csv_path, page_size=1500, max_record_count=1000, fail_every=7, rate=50):
+    pipeline.host_requests_per_second = rate
+    layer = load_layer(csv_path)
+    second = layer.iloc[::3].copy()
+    second['objectid'] = np.arange(len(second)) + layer['objectid'].min()
+    paths = ['/arcgis/rest/services/sad/FeatureServer/0', '/arcgis/rest/services/sad/FeatureServer/1']
+    server, stats = start_server(dict(zip(paths, [layer, second])), max_record_count=max_record_count,
+                                 fail_every=fail_every)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    first_url, second_url = base_url + paths[0], base_url + paths[1]
+    first, last = layer['date_parsed'].dt.year.min(), layer['date_parsed'].dt.year.max()
+    sources = [{'url': first_url, 'years': [int(first), int(last)]},
+               {'url': first_url, 'where': "data_type = 'defor'"},
+               {'url': second_url}]
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            output_path = os.path.join(scratch, 'deforestation.csv')
+            rows = pipeline.fetch_arcgis_sources(sources, output_path, page_size=page_size)
+            fetched = pd.read_csv(output_path)
+            spec = pipeline.columnar_sources['deforestation']
+            state = pipeline.start_quality_checks('deforestation', output_path)
+            failures = []
+            try:
+                pipeline.check_chunk(state, pd.read_csv(output_path, dtype={
+                    column: dtype for column, dtype in spec['dtype'].items() if dtype == 'string'}))
+            except pipeline.DataQualityError as e:
+                failures.append(f"the fetched alerts failed their quality checks: {e}")
+
+            # Permanent errors fail at once instead of being retried: an unknown layer (HTTP 404) and a where
+            # clause the layer rejects (ArcGIS error 400 inside a 200 response)
+            for source, status in [({'url': first_url[:-1] + '9'}, 404), ({'url': first_url, 'where': 'ha_eck_iv > 1'}, 400)]:
+                requests = stats['requests']
+                try:
+                    pipeline.fetch_arcgis_sources([source], output_path, page_size=page_size)
+                    failures.append(f"a query answered with {status} did not fail")
+                except Exception as e:
+                    if getattr(e, 'status', None) != status or stats['requests'] - requests > 2:
+                        failures.append(f"a query answered with {status} was retried or failed with {e!r}")
+    finally:
+        server.shutdown()
+
+    raw = pd.read_csv(csv_path)
+    expected = pd.concat([raw.assign(layer=first_url),
+                          raw.iloc[::3].assign(layer=second_url, objectid=second['objectid'].to_numpy())])
+    keys = ['layer', 'objectid']
+    if rows != len(expected) or sorted(fetched[keys].itertuples(index=False)) != sorted(expected[keys].itertuples(index=False)):
+        failures.append(f"fetched {rows} alerts, expected {len(expected)} distinct (layer, objectid) alerts")
+    merged = expected.merge(fetched, on=keys, suffixes=('', '_fetched'))
+    for column in ['date', 'data_type', 'ha_eck_iv', 'X', 'Y']:
+        same = merged[column] == merged[f'{column}_fetched']
+        if column in ('ha_eck_iv', 'X', 'Y'):
+            same = np.isclose(merged[column], merged[f'{column}_fetched'])
+        if not same.all():
+            failures.append(f"column {column} differs for {int((~same).sum())} alerts")
+    print(f"Mock ArcGIS self-test: {stats['requests']} requests, at most {stats['max_active']} in flight, "
+          f"{rows} alerts written from 2 layers")
+    for failure in failures:
+        print(f"FAILED {failure}")
+    return not failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a raw deforestation CSV as a mock ArcGIS feature layer")
+    parser.add_argument('--csv', default=os.path.join(pipeline.data_dir, 'deforestation.csv'))
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-record-count', type=int, default=1000)
+    parser.add_argument('--fail-every', type=int, default=0, help="fail every n-th request to exercise retries")
+    parser.add_argument('--self-test', action='store_true',
+                        help="fetch the mock layer through the pipeline's fetcher and compare with the CSV")
+    args = parser.parse_args()
+    if args.self_test:
+        sys.exit(0 if self_test(args.csv, max_record_count=args.max_record_count) else 1)
+    path = '/arcgis/rest/services/sad/FeatureServer/0'
+    server, _ = start_server({path: load_layer(args.csv)}, port=args.port, max_record_count=args.max_record_count,
+                             fail_every=args.fail_every)
+    print(f"Mock ArcGIS layer at http://127.0.0.1:{args.port}{path}")
+    threading.Event().wait()
@@ -0,0 +1,181 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pipeline
+
+
+range_header = re.compile(r'bytes=(\d+)-$')
+
+
+# Serve one file like a static file host: ETag and Last-Modified validators, 304 when If-None-Match or
+# If-Modified-Since still match, 206 for an open-ended Range whose If-Range still matches (the whole file
+# with 200 otherwise) and 404 for any other path; etag_mode sends a 'strong', 'weak' or no ('none') ETag.
+# A pending drop_after closes the connection after that many body bytes of the next response, and a pending
+# next_body replaces the file once that connection is dropped
+def make_handler(state, stats):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with state['lock']:
+                body, etag, last_modified = state['body'], state['etag'], state['last_modified']
+                drop_after, state['drop_after'] = state['drop_after'], 0
+                served_etag = {'strong': etag, 'weak': 'W/' + etag, 'none': None}[state['etag_mode']]
+
+            if self.path != '/' + state['name']:
+                stats['requests'].append({'range': None, 'if_range': None, 'status': 404,
+                                          'accept_encoding': self.headers.get('Accept-Encoding')})
+                return self.send_body(404, b'Not found', None, last_modified)
+            match = range_header.match(self.headers.get('Range', ''))
+            if_range = self.headers.get('If-Range')
+            offset = int(match.group(1)) if match and if_range in (None, etag, last_modified) else 0
+            unchanged = self.headers.get('If-None-Match') == etag or (
+                'If-None-Match' not in self.headers and self.headers.get('If-Modified-Since') == last_modified)
+            stats['requests'].append({'range': self.headers.get('Range'), 'if_range': if_range,
+                                      'status': 304 if unchanged else 206 if offset else 200,
+                                      'accept_encoding': self.headers.get('Accept-Encoding')})
+            if unchanged:
+                self.send_body(304, b'', served_etag, last_modified)
+            elif offset:
+                self.send_body(206, body[offset:], served_etag, last_modified,
+                               {'Content-Range': f'bytes {offset}-{len(body) - 1}/{len(body)}'}, drop_after)
+            else:
+                self.send_body(200, body, served_etag, last_modified, drop_after=drop_after)
+
+            if drop_after and state['next_body'] is not None:
+                set_body(state, state['next_body'])
+
+        def send_body(self, status, body, etag, last_modified, headers=None, drop_after=0):
+            self.send_response(status)
+            if etag is not None:
+                self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Accept-Ranges', 'bytes')
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            if status != 304:
+                self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:drop_after] if drop_after else body)
+            self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# Swap in a new version of the served file along with fresh validators
+def set_body(state, body):
+    with state['lock']:
+        state['body'] = body
+        state['etag'] = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        state['last_modified'] = formatdate(usegmt=True)
+        state['next_body'] = None
+
+
+def start_server(body, port=0, name='deforestation.csv'):
+    state = {'lock': threading.Lock(), 'drop_after': 0, 'next_body': None, 'etag_mode': 'strong', 'name': name}
+    set_body(state, body)
+    stats = {'requests': []}
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state, stats))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, stats
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# Download the file through the pipeline's fetcher: with the connection dropped halfway (the retry must resume
+# with Range/If-Range), revalidated with its ETag (304, nothing written), dropped again while the file changes
+# (the stale If-Range must restart the download), dropped without an ETag (If-Range falls back to Last-Modified)
+# and with a weak one (no resume), checking the bytes on disk after each; a missing file must fail without retries
+# and every request must ask for the body without content coding
+def self_test(file_path, chunk_size=None):
+    body = read_bytes(file_path)
+    # Chunks well below half the file, so the bytes before the drop reach the disk whatever the file size
+    chunk_size = chunk_size or max(1, min(1 << 16, len(body) // 16))
+    server, state, stats = start_server(body)
+    url = f'http://127.0.0.1:{server.server_address[1]}/deforestation.csv'
+    failures = []
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            output_path = os.path.join(scratch, 'deforestation.csv')
+
+            state['drop_after'] = len(body) // 2
+            changed, etag, last_modified = pipeline.fetch_data(url, output_path, chunk_size=chunk_size)
+            resumed = [request for request in stats['requests'] if request['status'] == 206]
+            if not changed or read_bytes(output_path) != body:
+                failures.append("the dropped download did not complete with the served bytes")
+            if not resumed or resumed[0]['if_range'] != state['etag']:
+                failures.append("the dropped download was not resumed with Range and If-Range")
+
+            changed, _, _ = pipeline.fetch_data(url, output_path, etag=etag, last_modified=last_modified,
+                                                chunk_size=chunk_size)
+            if changed or stats['requests'][-1]['status'] != 304 or read_bytes(output_path) != body:
+                failures.append("revalidating an unchanged file did not answer 304 and keep the local copy")
+
+            new_body = b'#' + body[1:]
+            state['drop_after'], state['next_body'] = len(body) // 2, new_body
+            count = len(stats['requests'])
+            pipeline.fetch_data(url, output_path, chunk_size=chunk_size)
+            restarted = stats['requests'][count + 1:]
+            if read_bytes(output_path) != new_body:
+                failures.append("a resume across a changed file did not restart with the new file")
+            if not restarted or restarted[0]['range'] is None or restarted[0]['status'] != 200:
+                failures.append("the stale If-Range was not answered with the whole new file")
+
+            body = read_bytes(output_path)
+            for mode, resumes in [('none', True), ('weak', False)]:
+                os.remove(output_path)
+                state['etag_mode'], state['drop_after'] = mode, len(body) // 2
+                count = len(stats['requests'])
+                pipeline.fetch_data(url, output_path, chunk_size=chunk_size)
+                retried = stats['requests'][count + 1:]
+                if read_bytes(output_path) != body:
+                    failures.append(f"the dropped download with a {mode} ETag did not complete with the served bytes")
+                elif resumes and (not retried or retried[0]['if_range'] != state['last_modified']
+                                  or retried[0]['status'] != 206):
+                    failures.append("without an ETag the download was not resumed with Last-Modified as If-Range")
+                elif not resumes and (not retried or retried[0]['range'] is not None):
+                    failures.append("a weak ETag was used to resume the download instead of starting over")
+
+            count = len(stats['requests'])
+            try:
+                pipeline.fetch_data(url.replace('deforestation.csv', 'missing.csv'), output_path, chunk_size=chunk_size)
+                failures.append("a missing file did not fail the download")
+            except Exception:
+                if len(stats['requests']) - count != 1:
+                    failures.append("a 404 was retried instead of failing at once")
+            if any(request['accept_encoding'] != 'identity' for request in stats['requests']):
+                failures.append("a request allowed a content coding, which breaks byte offsets of a resume")
+    finally:
+        server.shutdown()
+
+    statuses = [request['status'] for request in stats['requests']]
+    print(f"Mock download self-test: {len(stats['requests'])} requests ({', '.join(map(str, statuses))}) "
+          f"of a {len(body)} byte file")
+    for failure in failures:
+        print(f"FAILED {failure}")
+    return not failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a file with Range, If-Range and conditional GET support")
+    parser.add_argument('--file', default=os.path.join(pipeline.data_dir, 'deforestation.csv'))
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--self-test', action='store_true',
+                        help="download the file through the pipeline's fetcher with dropped connections and a 304")
+    args = parser.parse_args()
+    if args.self_test:
+        sys.exit(0 if self_test(args.file) else 1)
+    server, _, _ = start_server(read_bytes(args.file), port=args.port, name=os.path.basename(args.file))
+    print(f"Serving {args.file} at http://127.0.0.1:{args.port}/{os.path.basename(args.file)}")
+    threading.Event().wait()
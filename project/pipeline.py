@@ -1,21 +1,27 @@
 import os
+import argparse
+import hashlib
+import json
+import shutil
 import sqlite3
-import requests
+import threading
 import subprocess
 import pandas as pd
 import sys
 import time
-from functools import wraps
-import matplotlib
-matplotlib.use('Qt5Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial, wraps
+from importlib import import_module
+from urllib.parse import quote, urlsplit
 import numpy as np
 import random
 import math
-from scipy.stats import shapiro, probplot
-from scipy.stats import shapiro, probplot, spearmanr, kendalltau
-import statsmodels.api as sm
+# requests, aiohttp, asyncio, scipy.stats, matplotlib and seaborn are imported inside the functions that use them,
+# so the ETL commands start without loading the analysis and plotting stack
+
+# Interactive Qt windows only when a display is available; headless hosts and CI render with Agg
+headless = os.getenv('PIPELINE_HEADLESS') == 'true' or (
+    sys.platform.startswith('linux') and not (os.getenv('DISPLAY') or os.getenv('WAYLAND_DISPLAY')))
 
 
 # To see whether CI works or not
@@ -25,14 +31,120 @@ venv_path = os.path.join(sys.prefix, 'Scripts', 'kaggle.exe') if os.name == 'nt'
 
 # Set up paths
 script_dir = os.path.dirname(os.path.abspath(__file__))
-data_dir = os.path.abspath(os.path.join(script_dir, '..', 'data'))
+data_dir = os.path.abspath(os.path.expanduser(os.getenv('PIPELINE_DATA_DIR') or os.path.join(script_dir, '..', 'data')))
 if not os.path.exists(data_dir):
     os.makedirs(data_dir)
 
-deforestation_url = "https://hub.arcgis.com/api/v3/datasets/9c4a16f9520447349159fa30abcea08b_2/downloads/data?format=csv&spatialRefId=3857&where=1%3D1"
+deforestation_url = os.getenv('DEFORESTATION_URL') or "https://hub.arcgis.com/api/v3/datasets/9c4a16f9520447349159fa30abcea08b_2/downloads/data?format=csv&spatialRefId=3857&where=1%3D1"
+pollution_dataset = 'danlessa/air-pollution-at-so-paulo-brazil-since-2013'
+warehouse_db_path = os.path.join(data_dir, "warehouse.db")
+
+# More deforestation layers or queries: DEFORESTATION_SOURCES names a JSON list such as
+# [{"url": ".../FeatureServer/2", "where": "estado = 'PA'", "years": [2013, 2018]}], fetched concurrently from the
+# ArcGIS query API instead of the single CSV export ("years" splits a query into one query per year)
+deforestation_sources_path = os.getenv('DEFORESTATION_SOURCES')
+arcgis_page_size = int(os.getenv('ARCGIS_PAGE_SIZE', 2000))
+fetch_concurrency = int(os.getenv('PIPELINE_FETCH_CONCURRENCY', 8))
+host_requests_per_second = float(os.getenv('PIPELINE_HOST_RATE', 5))
+# Rows fetched from the query API carry the URL of their layer, since objectids only identify an alert within it
+arcgis_columns = ['layer', 'objectid', 'date', 'data_type', 'orig_fname', 'ha_eck_iv', 'shape_Length', 'shape_Area', 'X', 'Y']
+
+# Mock data volumes: 'tiny' is the original single month of data used by the tests, the larger scales feed
+# the benchmark suite (MOCK_SCALE picks one for USE_MOCK_DATA runs)
+mock_scales = {
+    'tiny': {'deforestation_rows': 3, 'stations': 1, 'years': 0},
+    'small': {'deforestation_rows': 100000, 'stations': 5, 'years': 2, 'seed': 0},
+    'medium': {'deforestation_rows': 1000000, 'stations': 20, 'years': 6, 'seed': 0},
+    'large': {'deforestation_rows': 5000000, 'stations': 50, 'years': 6, 'seed': 0}
+}
+mock_scale = os.getenv('MOCK_SCALE', 'tiny')
+
+# Per-stage metrics are appended to a JSON-lines run log; opt-in profiles are dumped next to it
+run_log_path = os.path.expanduser(os.getenv('PIPELINE_RUN_LOG') or os.path.join(data_dir, 'pipeline_runs.jsonl'))
+profile_dir = os.path.join(data_dir, 'profiles')
+run_log_lock = threading.Lock()
+profile_state = threading.local()
+tracemalloc_lock = threading.Lock()
+
+# Batch rendering never opens windows; plot functions only save and close their figures
+batch_plots = headless
+
+# Local cache of raw source files (size-bounded, least recently used entries are evicted first)
+cache_dir = os.path.expanduser(os.getenv('PIPELINE_CACHE_DIR') or os.path.join(data_dir, 'cache'))
+cache_max_bytes = int(os.getenv('PIPELINE_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+cache_ttl_seconds = int(os.getenv('PIPELINE_CACHE_TTL', 24 * 3600))
+cache_lock = threading.Lock()
+
+# Columnar (Parquet) copy of the raw sources, partitioned by year/month of their date column
+columnar_dir = os.path.join(data_dir, 'columnar')
+study_start = pd.Timestamp('2013-05-01')
+study_end = pd.Timestamp('2018-12-31')
+
+# Raw pollution columns mapped to the standard names used in the warehouse
+pollution_column_map = {'time': 'Date', 'MP10': 'PM10', 'TRS': 'TRS', 'O3': 'O3', 'NO2': 'NO2', 'CO': 'CO',
+                        'MP2.5': 'PM2.5', 'SO2': 'SO2', 'BENZENO': 'Benzene', 'TOLUENO': 'Toluene'}
+
+# Raw columns, dtypes and date format kept in the columnar store for each source
+columnar_sources = {
+    'deforestation': {
+        'date_column': 'date',
+        'date_format': '%Y/%m/%d %H:%M:%S%z',
+        'dtype': {'layer': 'string', 'objectid': 'Int64', 'date': 'string', 'data_type': 'string', 'orig_fname': 'string',
+                  'ha_eck_iv': 'float64', 'shape_Length': 'float64', 'shape_Area': 'float64',
+                  'X': 'float64', 'Y': 'float64', 'x': 'float64', 'y': 'float64',
+                  'longitude': 'float64', 'latitude': 'float64'}
+    },
+    'pollution': {
+        'date_column': 'time',
+        'date_format': '%Y-%m-%d %H:%M:%S',
+        'dtype': {'time': 'string', 'id': 'Int32',
+                  **{column: 'float32' for column in pollution_column_map if column != 'time'}}
+    }
+}
+
+# Spatial tile index: location columns the deforestation export may carry, either projected Web Mercator
+# metres (the download asks for spatialRefId=3857) or longitude/latitude degrees
+location_columns = [('X', 'Y', 'mercator'), ('x', 'y', 'mercator'), ('longitude', 'latitude', 'degrees')]
+mercator_half_extent = 20037508.342789244
+tile_zoom = min(int(os.getenv('PIPELINE_TILE_ZOOM', 8)), 15)  # zoom 8 tiles are about 150 km wide near the equator
+
+# Named bounding boxes (west, south, east, north in degrees) for area queries; the southern Amazon arc
+# (Acre, Rondonia, Mato Grosso) is roughly where smoke carried to Sao Paulo by the low-level jet comes from
+study_regions = {
+    'legal_amazon': (-74.0, -18.1, -44.0, 5.3),
+    'sao_paulo_upwind': (-66.0, -16.0, -50.0, -7.0)
+}
+
+# Declarative quality rules for the raw sources, checked on every chunk as it is read (see check_chunk):
+# required columns, values that do not parse as the schema dtype, value ranges, null ratios, unique keys and
+# timestamps increasing within a group. Violations of an error rule beyond the tolerated share of rows abort the
+# run before aggregation; warn rules are only reported. Every run's report goes to the data_quality table
+quality_tolerance = float(os.getenv('PIPELINE_QUALITY_TOLERANCE', 0.001))
+quality_log_path = os.path.join(os.path.dirname(run_log_path), 'data_quality.jsonl')
+quality_rules = {
+    'deforestation': {
+        'required': ['objectid', 'date', 'data_type', 'ha_eck_iv'],
+        'ranges': {'ha_eck_iv': (0, 1e6), 'shape_Length': (0, None), 'shape_Area': (0, None),
+                   'X': (-mercator_half_extent, mercator_half_extent), 'Y': (-mercator_half_extent, mercator_half_extent),
+                   'x': (-mercator_half_extent, mercator_half_extent), 'y': (-mercator_half_extent, mercator_half_extent),
+                   'longitude': (-180, 180), 'latitude': (-90, 90)},
+        'max_null_ratio': {'objectid': 0.01, 'date': 0.01, 'data_type': 0.01, 'ha_eck_iv': 0.01},
+        'unique': {'column': 'objectid', 'by': 'layer'},
+        'increasing': None
+    },
+    'pollution': {
+        'required': ['time', 'id'],
+        'ranges': {'MP10': (0, 1500), 'TRS': (0, 1000), 'O3': (0, 1000), 'NO2': (0, 2000), 'CO': (0, 100),
+                   'MP2.5': (0, 1000), 'SO2': (0, 2000), 'BENZENO': (0, 500), 'TOLUENO': (0, 1000)},
+        'max_null_ratio': {'time': 0.01, 'id': 0.01},
+        'unique': None,
+        'increasing': {'column': 'time', 'by': 'id', 'severity': 'warn'}
+    }
+}
 
-# Retry decorator
-def retry_on_failure(retries=100, delay=5):
+# Retry decorator (backoff > 1 grows the delay exponentially, jitter randomizes it up to that bound)
+# With retry_if, errors it rejects are raised at once instead of retried
+def retry_on_failure(retries=100, delay=5, backoff=1, max_delay=300, jitter=False, retry_if=None):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -40,93 +152,712 @@ def retry_on_failure(retries=100, delay=5):
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
-                    print(f"Error: {e}. Retrying in {delay} seconds... (Attempt {attempt}/{retries})")
-                    time.sleep(delay)
+                    if retry_if is not None and not retry_if(e):
+                        raise
+                    wait = min(max_delay, delay * backoff ** (attempt - 1))
+                    if jitter:
+                        wait = random.uniform(0, wait)
+                    print(f"Error: {e}. Retrying in {wait:.1f} seconds... (Attempt {attempt}/{retries})")
+                    time.sleep(wait)
             raise Exception(f"Failed after {retries} attempts.")
         return wrapper
     return decorator
+
+
+# Rows in a frame, or in the frames of a tuple/list (results of grouped cleaning); None for anything else
+def frame_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        counts = [frame_rows(item) for item in value]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+    return None
+
+
+# Bytes read and written so far by this process (read_chars counts page-cache and socket reads on Linux)
+def io_bytes(process):
+    try:
+        counters = process.io_counters()
+    except (AttributeError, NotImplementedError):
+        return 0, 0
+    return getattr(counters, 'read_chars', counters.read_bytes), getattr(counters, 'write_chars', counters.write_bytes)
+
+
+# Append one stage record to the JSON-lines run log
+def log_stage_record(record):
+    os.makedirs(os.path.dirname(run_log_path), exist_ok=True)
+    with run_log_lock, open(run_log_path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+# Start the opt-in profiler for the outermost profiled call of this thread
+# tracemalloc traces the whole process, so stages running on the io threads of one process take turns holding
+# it: each dump then covers a single stage (plus any unprofiled background threads), never a neighbour's
+def start_stage_profiler(mode):
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if mode == 'tracemalloc':
+        import tracemalloc
+        tracemalloc_lock.acquire()
+        if tracemalloc.is_tracing():
+            tracemalloc_lock.release()
+            return None
+        tracemalloc.start(25)
+        return tracemalloc
+    return None
+
+
+# Stop the profiler and dump its result under data/profiles/<run id>/
+def dump_stage_profile(mode, profiler, stage):
+    directory = os.path.join(profile_dir, os.getenv('PIPELINE_RUN_ID', 'adhoc'))
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"{stage}-{os.getpid()}-{time.time_ns()}")
+    if mode == 'cprofile':
+        profiler.disable()
+        profiler.dump_stats(base + '.prof')
+    else:
+        try:
+            snapshot = profiler.take_snapshot()
+            profiler.stop()
+        finally:
+            tracemalloc_lock.release()
+        with open(base + '.tracemalloc.txt', 'w') as f:
+            for statistic in snapshot.statistics('lineno')[:50]:
+                f.write(f"{statistic}\n")
+
+
+# Stage instrumentation: wall and CPU time, peak RSS, rows in and out and bytes read and written of each call
+# go to the run log; PIPELINE_PROFILE=cprofile|tracemalloc also dumps a profile of the outermost call
+def profiled(stage=None):
+    def decorator(func):
+        name = stage or func.__name__
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            import psutil
+            process = psutil.Process()
             
+            # Sample RSS in the background so the peak of this call is caught, not only the process lifetime peak
+            peak_rss = [process.memory_info().rss]
+            finished = threading.Event()
+            def sample_rss():
+                while not finished.wait(0.05):
+                    peak_rss[0] = max(peak_rss[0], process.memory_info().rss)
+            sampler = threading.Thread(target=sample_rss, daemon=True)
+            sampler.start()
+            
+            mode = os.getenv('PIPELINE_PROFILE')
+            outermost = not getattr(profile_state, 'active', False)
+            profiler = start_stage_profiler(mode) if mode and outermost else None
+            profile_state.active = True
+            
+            read_before, written_before = io_bytes(process)
+            started_at = pd.Timestamp.now().isoformat(timespec='milliseconds')
+            wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            status, error, result = 'ok', None, None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except Exception as e:
+                status, error = 'error', str(e)
+                raise
+            finally:
+                wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+                finished.set()
+                sampler.join()
+                peak_rss[0] = max(peak_rss[0], process.memory_info().rss)
+                read_after, written_after = io_bytes(process)
+                if outermost:
+                    profile_state.active = False
+                if profiler is not None:
+                    dump_stage_profile(mode, profiler, name)
+                
+                rows_in = [frame_rows(arg) for arg in list(args) + list(kwargs.values())]
+                rows_in = [rows for rows in rows_in if rows is not None]
+                log_stage_record({
+                    'run_id': os.getenv('PIPELINE_RUN_ID', 'adhoc'),
+                    'stage': name,
+                    'pid': os.getpid(),
+                    'started_at': started_at,
+                    'wall_seconds': round(wall, 6),
+                    'cpu_seconds': round(cpu, 6),
+                    'peak_rss_bytes': peak_rss[0],
+                    'rows_in': sum(rows_in) if rows_in else None,
+                    'rows_out': frame_rows(result),
+                    'bytes_read': read_after - read_before,
+                    'bytes_written': written_after - written_before,
+                    'status': status,
+                    'error': error
+                })
+        return wrapper
+    return decorator
 
-# Remove existing datasets before re-downloading
-def clear_existing_datasets():
-    deforestation_path = os.path.join(data_dir, "deforestation.csv")
-    pollution_path = os.path.join(data_dir, "air_pollution.csv")
+
+# Copy this run's records from the run log into the pipeline_runs table
+def record_run(run_id):
+    if not os.path.exists(run_log_path):
+        return 0
+    with open(run_log_path) as f:
+        records = [record for record in map(json.loads, f) if record['run_id'] == run_id]
+    if not records:
+        return 0
+    runs = pd.DataFrame(records)
+    runs.insert(1, 'seq', range(len(runs)))
+    conn = connect_warehouse()
+    try:
+        with conn:
+            conn.execute('DELETE FROM pipeline_runs WHERE run_id = ?', (run_id,))
+            insert_rows(conn, 'pipeline_runs', runs)
+    finally:
+        conn.close()
+    return len(runs)
+
+
+# Copy this run's quality report from the quality log into the data_quality table, returns its rows
+def record_quality_report(run_id):
+    if not os.path.exists(quality_log_path):
+        return None
+    with open(quality_log_path) as f:
+        records = [record for record in map(json.loads, f) if record['run_id'] == run_id]
+    if not records:
+        return None
     
-    if os.path.exists(deforestation_path):
-        os.remove(deforestation_path)
-        print("Removed existing deforestation dataset.")
-    if os.path.exists(pollution_path):
-        os.remove(pollution_path)
-        print("Removed existing pollution dataset.")
+    # A source read more than once in a run (an incremental merge, then the conversion of the full export) logs a
+    # report per pass; the passes add up to one row per rule, with the worst status and the first example
+    statuses = ['ok', 'warn', 'fail']
+    report = pd.DataFrame(records)
+    report['status'] = report['status'].map(statuses.index)
+    report = report.groupby(['run_id', 'source', 'rule', 'field'], sort=False).agg(
+        rows=('rows', 'sum'), violations=('violations', 'sum'), tolerance=('tolerance', 'first'),
+        status=('status', 'max'), example=('example', 'first'), checked_at=('checked_at', 'last')).reset_index()
+    report['ratio'] = (report['violations'] / report['rows'].where(report['rows'] > 0)).fillna(0.0)
+    report['status'] = [statuses[status] for status in report['status']]
+    report['example'] = report['example'].astype(object).where(report['example'].notna(), None)
+    conn = connect_warehouse()
+    try:
+        with conn:
+            conn.execute('DELETE FROM data_quality WHERE run_id = ?', (run_id,))
+            insert_rows(conn, 'data_quality', report)
+    finally:
+        conn.close()
+    return report
+
+
+# Cache index: source key -> content hash, HTTP validators, size and access times
+def load_cache_index():
+    index_path = os.path.join(cache_dir, 'index.json')
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def save_cache_index(index):
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, 'index.json')
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(index_path + '.tmp', index_path)
+
+
+# Cache entries are keyed by source URL or Kaggle dataset slug, objects by content hash
+def cache_key(source):
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def cache_object_path(content_hash):
+    return os.path.join(cache_dir, 'objects', content_hash)
+
+
+# Look up a cached source, refreshing its access time; None if missing
+def cache_lookup(source):
+    with cache_lock:
+        index = load_cache_index()
+        entry = index.get(cache_key(source))
+        if entry is None or not os.path.exists(cache_object_path(entry['hash'])):
+            return None
+        entry['accessed'] = time.time()
+        save_cache_index(index)
+        return entry
+
+
+# Add a downloaded file to the cache under its content hash and evict old entries
+def cache_store(source, file_path, etag=None, last_modified=None):
+    content_hash = file_checksum(file_path)
+    object_path = cache_object_path(content_hash)
+    if not os.path.exists(object_path):
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        copy_replace(file_path, object_path)
+    
+    with cache_lock:
+        index = load_cache_index()
+        now = time.time()
+        previous = index.get(cache_key(source))
+        index[cache_key(source)] = {
+            'source': source,
+            'hash': content_hash,
+            'size': os.path.getsize(object_path),
+            'etag': etag,
+            'last_modified': last_modified,
+            'stored': now,
+            'accessed': now
+        }
+        if previous is not None and previous['hash'] != content_hash:
+            release_cache_object(index, previous['hash'])
+        evict_cache(index, keep=cache_key(source))
+        save_cache_index(index)
+    return content_hash
+
+
+# Drop least recently used entries (and unreferenced objects) until the cache fits its size limit
+def evict_cache(index, keep=None):
+    sizes = {entry['hash']: entry['size'] for entry in index.values()}
+    total = sum(sizes.values())
+    for key, entry in sorted(index.items(), key=lambda item: item[1]['accessed']):
+        if total <= cache_max_bytes:
+            break
+        if key == keep:
+            continue
+        del index[key]
+        if release_cache_object(index, entry['hash']):
+            total -= entry['size']
+            print(f"Evicted {entry['source']} from the cache")
+
+
+# Delete a cached object once no index entry references it; returns whether it was released
+def release_cache_object(index, content_hash):
+    if any(entry['hash'] == content_hash for entry in index.values()):
+        return False
+    object_path = cache_object_path(content_hash)
+    if os.path.exists(object_path):
+        os.remove(object_path)
+    return True
+
+
+# Copy a file next to its target and move it into place, so readers never see a partial file
+# Cache objects and data files are never hard links of each other: the data files are rewritten in place
+# (mock data, Kaggle's --unzip), which would corrupt the cached copy through a shared inode
+def copy_replace(source_path, target_path):
+    staging_path = target_path + '.cache-copy'
+    shutil.copyfile(source_path, staging_path)
+    os.replace(staging_path, target_path)
+
+
+# Place a cached object at the path the pipeline reads from
+def cache_materialize(entry, file_path):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    copy_replace(cache_object_path(entry['hash']), file_path)
 
 
 # Generate mock data
-def create_mock_data():
+@profiled()
+def create_mock_data(deforestation_rows=3, stations=1, years=0, missing=0.2, seed=None):
+    # Seeded mock data is deterministic, so a copy generated with the same parameters is reused
+    parameters = {'deforestation_rows': deforestation_rows, 'stations': stations, 'years': years,
+                  'missing': missing, 'seed': seed}
+    marker_path = os.path.join(data_dir, 'mock_data.json')
+    pollution_path = os.path.join(data_dir, 'cetesb.csv', 'cetesb.csv')
+    if seed is not None and os.path.exists(marker_path) and os.path.exists(pollution_path):
+        with open(marker_path) as f:
+            if json.load(f) == parameters and os.path.exists(os.path.join(data_dir, 'deforestation.csv')):
+                print("Reusing existing mock data.")
+                return
+    
+    rng = np.random.default_rng(seed)
+    
+    # years=0 keeps the original single month of mock data; multi-year volumes spread alerts over the whole
+    # period and mix alert types like the real SAD export
+    if years:
+        start = pd.Timestamp('2013-01-01')
+        offsets = rng.integers(0, int(years * 365 * 24 * 3600), deforestation_rows)
+        dates = (start + pd.to_timedelta(offsets, unit='s')).strftime('%Y/%m/%d %H:%M:%S+00')
+        data_types = rng.choice(['defor', 'degrad'], deforestation_rows, p=[0.7, 0.3])
+        time_range = pd.date_range(start=start, periods=int(years * 365 * 24), freq='h')
+    else:
+        dates = pd.date_range(start='2013-07-31', periods=deforestation_rows, freq='ME').strftime('%Y/%m/%d %H:%M:%S+00')
+        data_types = np.array(['defor'] * deforestation_rows)
+        time_range = pd.date_range(start='2013-07-31 00:00:00', end='2013-08-31 00:00:00', freq='h')
+    
     # Mock deforestation data
     mock_deforestation = pd.DataFrame({
-        'objectid': np.arange(53716, 53716 + 3),  # 12 mock rows starting from the provided objectid
-        'date': pd.date_range(start='2013-07-31', periods=3, freq='M').strftime('%Y/%m/%d %H:%M:%S+00'),
-        'data_type': ['defor'] * 3,  # All rows are of type 'degrad'
-        'orig_oid': np.random.randint(0, 10, 3),
-        'orig_fname': ['imazon_sad_degradacao_2014-07_amazonia.shp'] * 3,
-        'gfwid': np.random.choice(['900D21D4-98A0-49CE-962F-8AAC8C6740FB', '541FAB70-B4B4-4A0C-8647-4231CA6D16FA', 
-                                   '2C57D170-C76F-4784-977A-0C470BEE4E82', '9C5CDF75-10E5-4B1E-B198-1822447FE0C6'], 3),
-        'globalid': np.random.choice(['{BBFDA6BE-3BAB-47C7-809F-1DDE5CE0FB91}', '{26DDC927-7941-41EC-BB6F-AB1E9A03A1FE}', 
-                                      '{501ACF77-105F-43E3-8513-F7CCEF9AE8D3}', '{15936FD5-1FBA-473D-9E8E-AB326D376E1B}'], 3),
-        'ha_eck_iv': np.random.uniform(5, 2000, 3),  # Random float values for hectares (within reasonable deforestation range)
-        'date_alias': pd.date_range(start='2013-07-31', periods=3, freq='M').strftime('%Y/%m/%d %H:%M:%S+00'),
-        'shape_Length': np.random.uniform(1000, 10000, 3),  # Mock shape length values
-        'shape_Area': np.random.uniform(100000, 5000000, 3)  # Mock shape area values
+        'objectid': np.arange(53716, 53716 + deforestation_rows),
+        'date': dates,
+        'data_type': data_types,
+        'orig_oid': rng.integers(0, 10, deforestation_rows),
+        'orig_fname': np.char.add(np.char.add('imazon_sad_', np.where(data_types == 'defor', 'desmatamento', 'degradacao')),
+                                  '_amazonia.shp'),
+        'gfwid': rng.choice(['900D21D4-98A0-49CE-962F-8AAC8C6740FB', '541FAB70-B4B4-4A0C-8647-4231CA6D16FA', 
+                             '2C57D170-C76F-4784-977A-0C470BEE4E82', '9C5CDF75-10E5-4B1E-B198-1822447FE0C6'], deforestation_rows),
+        'globalid': rng.choice(['{BBFDA6BE-3BAB-47C7-809F-1DDE5CE0FB91}', '{26DDC927-7941-41EC-BB6F-AB1E9A03A1FE}', 
+                                '{501ACF77-105F-43E3-8513-F7CCEF9AE8D3}', '{15936FD5-1FBA-473D-9E8E-AB326D376E1B}'], deforestation_rows),
+        'ha_eck_iv': rng.uniform(5, 2000, deforestation_rows),  # Random float values for hectares (within reasonable deforestation range)
+        'date_alias': dates,
+        'shape_Length': rng.uniform(1000, 10000, deforestation_rows),  # Mock shape length values
+        'shape_Area': rng.uniform(100000, 5000000, deforestation_rows)  # Mock shape area values
     })
+    # Alert centroids in Web Mercator, scattered over the Legal Amazon
+    west, south, east, north = study_regions['legal_amazon']
+    mock_deforestation['X'], mock_deforestation['Y'] = lonlat_to_mercator(rng.uniform(west, east, deforestation_rows),
+                                                                          rng.uniform(south, north, deforestation_rows))
     mock_deforestation.to_csv(os.path.join(data_dir, 'deforestation.csv'), index=False)
-
-    # Generate hourly time data for a full year (365 days)
-    time_range = pd.date_range(start='2013-07-31 00:00:00', end='2013-08-31 00:00:00', freq='H')
     
-    # Mock pollution data
+    # Mock pollution data: hourly readings per station, the first station keeps the original id 65
+    rows = len(time_range) * stations
     mock_pollution = pd.DataFrame({
-        '': np.arange(0, len(time_range)),
-        'time': time_range,
-        'id': [65] * len(time_range),
-        'MP10': np.nan,
-        'TRS': np.nan,
-        'O3': np.nan,
-        'NO2': np.nan,
-        'CO': np.nan,
-        'MP2.5': np.nan,
-        'SO2': np.nan,
-        'BENZENO': np.nan,
-        'TOLUENO': np.nan
+        '': np.arange(0, rows),
+        'time': np.tile(time_range, stations),
+        'id': np.repeat(65 + np.arange(stations), len(time_range))
     })
-    # Randomly fill in missing values for pollutants (for demonstration purposes)
+    # Randomly fill in values for pollutants, leaving a `missing` share of readings empty
     for column in ['MP10', 'TRS', 'O3', 'NO2', 'CO', 'MP2.5', 'SO2', 'BENZENO', 'TOLUENO']:
-        mock_pollution[column] = mock_pollution[column].apply(lambda x: random.uniform(5, 30) if random.random() > 0.2 else np.nan)
+        values = rng.uniform(5, 30, rows)
+        values[rng.random(rows) < missing] = np.nan
+        mock_pollution[column] = values
         
     # Save mock pollution data in the "cetesb.csv" folder
     cetesb_dir = os.path.join(data_dir, 'cetesb.csv')
     os.makedirs(cetesb_dir, exist_ok=True)  # Ensure the folder exists
     mock_pollution.to_csv(os.path.join(cetesb_dir, 'cetesb.csv'), index=False)
-    print("Mock data created.")
+    with open(marker_path, 'w') as f:
+        json.dump(parameters, f)
+    print(f"Mock data created ({deforestation_rows} alerts, {rows} hourly readings).")
 
 
-# Download function for deforestation data
-@retry_on_failure(retries=100, delay=5)
-def download_data(url, file_path):
-    response = requests.get(url)
-    response.raise_for_status()
-    with open(file_path, 'wb') as f:
-        f.write(response.content)
+# Download function for deforestation data via the local cache, returns (changed, etag, last_modified)
+@profiled()
+def download_data(url, file_path, etag=None, last_modified=None, offline=False):
+    entry = cache_lookup(url)
+    if offline:
+        if entry is None:
+            raise FileNotFoundError(f"{url} is not cached, cannot run offline")
+        cache_materialize(entry, file_path)
+        print(f"Using cached {file_path}")
+        return True, entry['etag'], entry['last_modified']
+    
+    # Revalidate the cached copy with its own validators when the caller has none
+    if entry is not None:
+        etag = etag or entry['etag']
+        last_modified = last_modified or entry['last_modified']
+    changed, etag, last_modified = fetch_data(url, file_path, etag, last_modified)
+    if changed:
+        cache_store(url, file_path, etag, last_modified)
+    elif entry is not None:
+        cache_materialize(entry, file_path)
+    return changed, etag, last_modified
+
+
+# A download that stopped short of its Content-Length or resumed at the wrong offset
+class IncompleteDownloadError(IOError):
+    pass
+
+
+# Download failures worth retrying: 429 and 5xx responses, dropped connections, timeouts and truncated bodies;
+# other HTTP errors (403, 404, ...) and invalid requests are permanent
+def transient_download_error(error):
+    import requests
+    
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and retryable_status(error.response.status_code)
+    return isinstance(error, (IncompleteDownloadError, requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+
+# Fetch a URL, returns (changed, etag, last_modified)
+# The body is streamed to a ".part" file so a dropped connection resumes where it stopped. It is asked for without
+# content coding, so the bytes on disk are the bytes a Range offset counts, and a resume is conditional on the
+# strong ETag of the first response (its Last-Modified when it had none); otherwise the download starts over
+@retry_on_failure(retries=10, delay=1, backoff=2, max_delay=60, jitter=True, retry_if=transient_download_error)
+def fetch_data(url, file_path, etag=None, last_modified=None, chunk_size=1 << 20):
+    part_path = file_path + '.part'
+    validator_path = part_path + '.validators'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validators = {}
+    if offset and os.path.exists(validator_path):
+        with open(validator_path) as f:
+            validators = json.load(f)
+    if_range = validators.get('etag') or validators.get('last_modified')
+    
+    headers = {'Accept-Encoding': 'identity'}
+    if offset and if_range and not if_range.startswith('W/'):
+        # Resume the partial download, but only if the remote file is still the same one
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = if_range
+    else:
+        # Conditional GET so an unchanged source is not transferred again; a partial file without a strong
+        # validator cannot be resumed safely and is downloaded again
+        offset = 0
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+    
+    import requests
+    
+    with requests.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+        if response.status_code == 304:
+            print(f"{file_path} is unchanged since the last run")
+            return False, etag, last_modified
+        response.raise_for_status()
+        
+        # 206 continues the partial file, anything else starts it over
+        if response.status_code == 206:
+            if not response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+                os.remove(part_path)
+                raise IncompleteDownloadError(f"Unexpected Content-Range for {file_path}, restarting download")
+            mode = 'ab'
+        else:
+            mode, offset = 'wb', 0
+            validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+            # A server that compresses anyway sends bytes the decoded file cannot be resumed from
+            if response.headers.get('Content-Encoding', 'identity') != 'identity':
+                validators = {}
+            with open(validator_path, 'w') as f:
+                json.dump(validators, f)
+        
+        expected = response.headers.get('Content-Length')
+        written = 0
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                written += len(chunk)
+        if expected is not None and written < int(expected):
+            raise IncompleteDownloadError(f"Connection closed after {offset + written} bytes of {file_path}")
+        
+        new_etag = response.headers.get('ETag') or validators.get('etag')
+        new_last_modified = response.headers.get('Last-Modified') or validators.get('last_modified')
+    
+    if os.path.exists(validator_path):
+        os.remove(validator_path)
+    os.replace(part_path, file_path)
     print(f"Downloaded {file_path}")
+    return True, new_etag, new_last_modified
+
+
+# Build the deforestation URL restricted to alerts on or after a given date
+def deforestation_url_since(since):
+    where = f"date >= DATE '{since.strftime('%Y-%m-%d')}'"
+    return deforestation_url.replace("where=1%3D1", f"where={quote(where)}")
+
+
+# The ArcGIS source list from DEFORESTATION_SOURCES, None when it is not set
+def load_deforestation_sources(path=None):
+    path = path or deforestation_sources_path
+    if not path:
+        return None
+    with open(os.path.expanduser(path)) as f:
+        return json.load(f)
+
+
+# One query (layer URL and where clause) per source, or per source and year when it has "years";
+# `since` restricts every query to alerts on or after that date
+def arcgis_queries(sources, since=None):
+    queries = []
+    for source in sources:
+        date_field = source.get('date_field', 'date')
+        where = f"({source.get('where') or '1=1'})"
+        if since is not None:
+            where += f" AND {date_field} >= DATE '{since.strftime('%Y-%m-%d')}'"
+        years = source.get('years')
+        if not years:
+            queries.append({'url': source['url'], 'where': where, 'order_by': source.get('order_by', 'objectid')})
+            continue
+        for year in range(years[0], years[-1] + 1):
+            if since is not None and year < since.year:
+                continue
+            queries.append({
+                'url': source['url'],
+                'where': f"{where} AND {date_field} >= DATE '{year}-01-01' AND {date_field} < DATE '{year + 1}-01-01'",
+                'order_by': source.get('order_by', 'objectid')
+            })
+    return queries
+
+
+# Features of an ArcGIS JSON page as rows of the raw CSV export: epoch-millisecond dates in the export's
+# format, the point location or polygon centroid (asked for in Web Mercator) as X/Y and the layer URL
+def arcgis_page_frame(features, layer):
+    rows = pd.DataFrame([feature.get('attributes') or {} for feature in features])
+    rows['layer'] = layer
+    for column in ['date', 'date_alias']:
+        if column in rows.columns and pd.api.types.is_numeric_dtype(rows[column]):
+            rows[column] = pd.to_datetime(rows[column], unit='ms', utc=True).dt.strftime('%Y/%m/%d %H:%M:%S+00')
+    points = [feature.get('centroid') or feature.get('geometry') or {} for feature in features]
+    if any('x' in point for point in points):
+        rows['X'] = [point.get('x') for point in points]
+        rows['Y'] = [point.get('y') for point in points]
+    return rows.reindex(columns=arcgis_columns)
+
+
+# Wait for the next free request slot of a host so it sees at most host_requests_per_second requests;
+# the event loop is single threaded, so reserving the slot needs no lock
+async def throttle_host(schedule, host):
+    import asyncio
+    
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    slot = max(now, schedule.get(host, now))
+    schedule[host] = slot + 1 / host_requests_per_second
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+
+# An error ArcGIS reports inside a 200 response, with the HTTP-like status code it carries
+class ArcGISError(IOError):
+    def __init__(self, status, message):
+        super().__init__(f"ArcGIS error {status}: {message}")
+        self.status = status
+
+
+# Rate limiting and server-side failures are worth retrying; any other status (400, 404, ...) is permanent
+def retryable_status(status):
+    return isinstance(status, int) and (status == 429 or 500 <= status < 600)
+
+
+# GET one ArcGIS query on the shared session, bounded by the concurrency semaphore and paced per host;
+# 429 and 5xx responses (also when ArcGIS reports them inside a 200 response), timeouts, dropped connections
+# and truncated payloads back off and retry, other errors are raised at once
+async def arcgis_request(session, limits, url, params, retries=10, delay=1, max_delay=60):
+    import asyncio
+    import aiohttp
+    
+    host = urlsplit(url).netloc
+    for attempt in range(retries + 1):
+        await throttle_host(limits['schedule'], host)
+        try:
+            async with limits['semaphore']:
+                async with session.get(url, params=params) as response:
+                    response.raise_for_status()
+                    payload = await response.json(content_type=None)
+            if 'error' in payload:
+                raise ArcGISError(payload['error'].get('code'), payload['error'].get('message'))
+            return payload
+        except (aiohttp.ClientResponseError, ArcGISError) as e:
+            if not retryable_status(e.status) or attempt == retries:
+                raise
+            error = e
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            if attempt == retries:
+                raise
+            error = e
+        wait = min(delay * 2 ** attempt, max_delay) * random.uniform(0.5, 1.5)
+        print(f"Error fetching {url}: {error}. Retrying in {wait:.1f}s...")
+        await asyncio.sleep(wait)
+
+
+# Fetch every page of one query: the record count first, then all resultOffset pages concurrently, each handed
+# to on_page as it arrives. A server whose maxRecordCount is below the page size returns part of a page with
+# exceededTransferLimit set, and the rest of that page is asked for from where it stopped
+async def fetch_arcgis_query(session, limits, query, on_page, page_size):
+    import asyncio
+    
+    url = query['url'].rstrip('/') + '/query'
+    params = {'where': query['where'], 'f': 'json'}
+    count = (await arcgis_request(session, limits, url, {**params, 'returnCountOnly': 'true'}))['count']
+    
+    async def fetch_page(offset):
+        end = min(offset + page_size, count)
+        while offset < end:
+            payload = await arcgis_request(session, limits, url, {
+                **params, 'outFields': '*', 'orderByFields': query['order_by'], 'returnGeometry': 'false',
+                'returnCentroid': 'true', 'outSR': 3857, 'resultOffset': offset, 'resultRecordCount': end - offset
+            })
+            features = payload.get('features') or []
+            if not features:
+                break
+            on_page(features)
+            offset += len(features)
+            if not payload.get('exceededTransferLimit') and offset < end:
+                break
+    
+    await asyncio.gather(*(fetch_page(offset) for offset in range(0, count, page_size)))
+    return count
+
+
+# Fetch all queries over one pooled session, streaming each page into the raw CSV as soon as it arrives;
+# alerts are keyed by (layer, objectid), so those returned by overlapping queries of the same layer are written
+# once while alerts of different layers sharing an objectid are all kept. Returns the rows written
+async def fetch_arcgis_sources_async(queries, file_path, page_size):
+    import asyncio
+    import aiohttp
+    
+    part_path = file_path + '.part'
+    seen = set()
+    written = [0]
+    with open(part_path, 'w', newline='') as f:
+        pd.DataFrame(columns=arcgis_columns).to_csv(f, index=False)
+        
+        def write_page(url, features):
+            page = arcgis_page_frame(features, url)
+            keys = [(url, objectid) for objectid in page['objectid']]
+            new = np.array([key not in seen for key in keys], dtype=bool)
+            seen.update(keys)
+            page[new].to_csv(f, header=False, index=False)
+            written[0] += int(new.sum())
+        
+        connector = aiohttp.TCPConnector(limit=fetch_concurrency, limit_per_host=fetch_concurrency)
+        timeout = aiohttp.ClientTimeout(total=None, connect=10, sock_read=60)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            limits = {'semaphore': asyncio.Semaphore(fetch_concurrency), 'schedule': {}}
+            counts = await asyncio.gather(*(fetch_arcgis_query(session, limits, query, partial(write_page, query['url']), page_size)
+                                            for query in queries))
+    os.replace(part_path, file_path)
+    print(f"Fetched {written[0]} alerts from {len(queries)} ArcGIS queries ({sum(counts)} matched) into {file_path}")
+    return written[0]
+
+
+def fetch_arcgis_sources(sources, file_path, since=None, page_size=None):
+    import asyncio
+    
+    return asyncio.run(fetch_arcgis_sources_async(arcgis_queries(sources, since), file_path, page_size or arcgis_page_size))
+
+
+# Download the ArcGIS sources via the local cache, returns (changed, etag, last_modified) like download_data;
+# the query API has no validators, so every online run fetches again
+@profiled()
+def download_arcgis_sources(sources, file_path, since=None, offline=False):
+    source = 'arcgis:' + json.dumps({'sources': sources, 'since': None if since is None else str(since)}, sort_keys=True)
+    entry = cache_lookup(source)
+    if offline:
+        if entry is None:
+            raise FileNotFoundError(f"{deforestation_sources_path} is not cached, cannot run offline")
+        cache_materialize(entry, file_path)
+        print(f"Using cached {file_path}")
+        return True, None, None
+    fetch_arcgis_sources(sources, file_path, since=since)
+    cache_store(source, file_path)
+    return True, None, None
     
 
+# Download pollution data via the local cache, only shelling out to Kaggle when it is missing or stale
+@profiled()
+def download_pollution_data(offline=False):
+    cetesb_file_path = os.path.join(data_dir, "cetesb.csv", "cetesb.csv")
+    source = f"kaggle:{pollution_dataset}"
+    entry = cache_lookup(source)
+    if entry is not None and (offline or time.time() - entry['stored'] < cache_ttl_seconds):
+        cache_materialize(entry, cetesb_file_path)
+        print(f"Using cached pollution dataset: {cetesb_file_path}")
+        return cetesb_file_path
+    if offline:
+        raise FileNotFoundError(f"{source} is not cached, cannot run offline")
+    
+    cetesb_file_path = fetch_pollution_data()
+    if cetesb_file_path:
+        cache_store(source, cetesb_file_path)
+    return cetesb_file_path
+
+
 # Download pollution data using Kaggle API with subprocess
 @retry_on_failure(retries=100, delay=5)
-def download_pollution_data():
+def fetch_pollution_data():
     try:
         # Kaggle CLI download command
         kaggle_command = [
             venv_path,
-            'datasets', 'download', '-d', 'danlessa/air-pollution-at-so-paulo-brazil-since-2013',
+            'datasets', 'download', '-d', pollution_dataset,
             '-p', data_dir, '--unzip'
         ]
         
@@ -145,99 +876,1769 @@ def download_pollution_data():
         return None
     
 
-# Apply transformations to deforestation dataset
-def clean_deforestation_data(df):
-    
-    # Focus only on major deforestation events
-    df = df[df['data_type'] == 'defor']
-    
-    # Only keep date, ha_eck_iv, and shape_Area
-    df = df.rename(columns={
-        'date': 'Date',
-        'ha_eck_iv': 'AffectedArea'
-    })
-    df = df[['Date', 'AffectedArea']]
+# Resampling engine: int64 bucket codes (days, or a coarser unit such as months, since the epoch)
+# for a datetime64 array without NaT
+def bucket_codes(dates, unit):
+    nanoseconds = np.asarray(dates, dtype='datetime64[ns]').view('int64')
+    days = np.floor_divide(nanoseconds, 86400 * 10 ** 9)
+    if unit == 'D' or len(days) == 0:
+        return days
+    
+    # Calendar units only need converting once per distinct day, then a table lookup per row
+    first = days.min()
+    table = np.arange(first, days.max() + 1).astype('datetime64[D]').astype(f'datetime64[{unit}]').astype('int64')
+    return table[days - first]
+
+
+# Month-start (or day) timestamps for bucket codes
+def codes_to_timestamps(codes, unit):
+    return pd.DatetimeIndex(np.asarray(codes, dtype='int64').astype(f'datetime64[{unit}]').astype('datetime64[ns]'))
+
+
+# Columns of a DataFrame, Series, list of columns or 2-D array as separate float64 arrays
+# Passing [df[column] for column in columns] avoids copying a DataFrame column selection
+def value_columns(values):
+    if isinstance(values, (list, tuple)):
+        return [np.asarray(column, dtype='float64') for column in values]
+    if isinstance(values, pd.DataFrame):
+        return [values[column].to_numpy(dtype='float64', na_value=np.nan) for column in values.columns]
+    if isinstance(values, pd.Series):
+        return [values.to_numpy(dtype='float64', na_value=np.nan)]
+    values = np.asarray(values, dtype='float64')
+    return [values] if values.ndim == 1 else [values[:, column] for column in range(values.shape[1])]
+
+
+# NaN-aware per-bucket sums and counts of every column
+# Returns the codes of buckets that received at least one row, with their (buckets x columns) sums and counts
+# With compensated=True each column is split into a coarse part whose bucket sums are exact and a tiny
+# remainder, so sums are as accurate as pandas' compensated groupby sums and rounded outputs agree
+def bucket_sums(codes, values, compensated=True):
+    columns = value_columns(values)
+    codes = np.asarray(codes, dtype='int64')
+    if len(codes) == 0:
+        return np.empty(0, dtype='int64'), np.empty((0, len(columns))), np.empty((0, len(columns)), dtype='int64')
+    
+    # Rows mostly come in runs sharing a code (one station's readings within a day), so every column is
+    # first summed per run with reduceat and only the much shorter run totals are binned with bincount
+    starts = np.concatenate(([0], np.flatnonzero(codes[1:] != codes[:-1]) + 1))
+    run_lengths = np.diff(np.append(starts, len(codes)))
+    run_codes = codes[starts]
+    base = run_codes.min()
+    if run_codes.max() - base < 4 * len(run_codes) + 4096:
+        bucket_keys = None
+        offsets = run_codes - base
+        size = int(offsets.max()) + 1
+    else:
+        # Sparse codes (e.g. grouped codes) are compacted so the bins stay proportional to the data
+        bucket_keys, offsets = np.unique(run_codes, return_inverse=True)
+        size = len(bucket_keys)
+    rows = np.bincount(offsets, weights=run_lengths, minlength=size)
+    
+    # Scratch buffers are reused for every column to avoid reallocating row-sized arrays
+    missing = np.empty(len(codes))
+    weights = np.empty(len(codes))
+    coarse = np.empty(len(codes))
+    sums = np.empty((size, len(columns)))
+    counts = np.empty((size, len(columns)), dtype='int64')
+    for number, column in enumerate(columns):
+        # NaN becomes 0 via fmax(x, 0) + fmin(x, 0), which is much cheaper than a masked assignment
+        np.fmax(column, 0.0, out=weights)
+        np.fmin(column, 0.0, out=coarse)
+        weights += coarse
+        np.isnan(column, out=missing)
+        missing_per_bucket = np.bincount(offsets, weights=np.add.reduceat(missing, starts), minlength=size)
+        counts[:, number] = rows - missing_per_bucket
+        
+        largest = max(weights.max(), -weights.min())
+        if compensated and np.isfinite(largest) and largest > 0:
+            # Adding and removing 1.5 * 2**52 * step rounds every value to a multiple of step
+            magic = 1.5 * 2.0 ** (np.floor(np.log2(largest)) + 33)
+            np.add(weights, magic, out=coarse)
+            np.subtract(coarse, magic, out=coarse)
+            np.subtract(weights, coarse, out=weights)
+            sums[:, number] = np.bincount(offsets, weights=np.add.reduceat(coarse, starts), minlength=size)
+            sums[:, number] += np.bincount(offsets, weights=np.add.reduceat(weights, starts), minlength=size)
+        else:
+            sums[:, number] = np.bincount(offsets, weights=np.add.reduceat(weights, starts), minlength=size)
+    
+    present = rows > 0
+    bucket_codes_present = np.flatnonzero(present) + base if bucket_keys is None else bucket_keys[present]
+    return bucket_codes_present, sums[present], counts[present]
+
+
+# Grouped bucket codes: a non-negative group number in the high 32 bits, the time bucket in the low 32 bits
+def combine_codes(groups, codes):
+    return (np.asarray(groups, dtype='int64') << 32) | (codes + 2 ** 31)
+
+
+def split_codes(codes):
+    return codes >> 32, (codes & 0xFFFFFFFF) - 2 ** 31
+
+
+# Daily sums and counts of each column for rows with a valid date (and group, when grouped by integer groups);
+# partials from separate chunks can be merged
+def daily_partials(dates, values, groups=None):
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    missing = np.isnat(dates)
+    if groups is not None:
+        groups = pd.array(groups, dtype='Int64')
+        missing |= np.asarray(groups.isna())
+        groups = groups.to_numpy(dtype='int64', na_value=0)
+    if missing.any():
+        dates = dates[~missing]
+        values = [column[~missing] for column in value_columns(values)]
+        groups = groups[~missing] if groups is not None else None
+    codes = bucket_codes(dates, 'D')
+    if groups is not None:
+        codes = combine_codes(groups, codes)
+    return bucket_sums(codes, values, compensated=False)
+
+
+# Merge daily partials computed on separate chunks (a day may be split across chunks)
+def merge_partials(partials):
+    codes = np.concatenate([partial[0] for partial in partials])
+    merged_codes, sums, _ = bucket_sums(codes, np.concatenate([partial[1] for partial in partials]))
+    _, counts, _ = bucket_sums(codes, np.concatenate([partial[2] for partial in partials]))
+    return merged_codes, sums, counts.astype('int64')
+
+
+# Monthly mean of daily means: days without readings of a column are skipped for that column
+def monthly_mean_of_daily_means(day_codes, sums, counts, grouped=False):
+    if grouped:
+        groups, days = split_codes(day_codes)
+        month_codes = combine_codes(groups, bucket_codes(days.astype('datetime64[D]'), 'M'))
+    else:
+        month_codes = bucket_codes(day_codes.astype('datetime64[D]'), 'M')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily_means = sums / np.where(counts > 0, counts, np.nan)
+        month_codes, month_sums, month_counts = bucket_sums(month_codes, daily_means)
+        monthly_means = month_sums / np.where(month_counts > 0, month_counts, np.nan)
+    return month_codes, monthly_means
+
+
+# One pass from timestamped rows to the monthly mean of daily means
+def resample_mean_of_means(dates, values):
+    return monthly_mean_of_daily_means(*daily_partials(dates, values))
+
+
+# Apply transformations to deforestation dataset (optionally only alerts on or after `since`)
+@profiled()
+def clean_deforestation_data(df, since=None):
+    
+    # Focus only on major deforestation events
+    df = df[df['data_type'] == 'defor']
+    
+    # Only keep date, ha_eck_iv, and shape_Area
+    df = df.rename(columns={
+        'date': 'Date',
+        'ha_eck_iv': 'AffectedArea'
+    })
+    df = df[['Date', 'AffectedArea']]
+    
+    # Standardize the time format
+    df['Date'] = pd.to_datetime(df['Date'], format='%Y/%m/%d %H:%M:%S%z', errors='coerce')
+    df['Date'] = df['Date'].dt.tz_localize(None) # Remove timezone information
+    
+    # Skip alerts before the high-water mark in incremental runs
+    if since is not None:
+        df = df[df['Date'] >= since]
+    
+    # Sort ascendingly by time
+    df = df.sort_values(by='Date', ascending=True)
+    
+    # Drop rows with missing values
+    df = df.dropna(subset=['Date', 'AffectedArea'])
+    
+    # Aggregate by summing AffectedArea per month
+    month_codes, sums, _ = bucket_sums(bucket_codes(df['Date'], 'M'), df['AffectedArea'])
+    df = pd.DataFrame({'Date': codes_to_timestamps(month_codes, 'M'), 'AffectedArea': sums[:, 0]})
+    
+    # Filter for the overlapping period
+    df = df[(df['Date'] >= '2013-05-01') & (df['Date'] <= '2018-12-31')]
+    
+    # Setting the date as the index
+    df.set_index('Date', inplace=True)
+    
+    # Reindex to fill missing months
+    all_dates = pd.date_range(start=df.index.min(), end=df.index.max(), freq='MS')  # Monthly start frequency
+    df = df.reindex(all_dates)
+    
+    # Interpolate missing values linearly
+    log_filled_values('deforestation', 'interpolated', len(df), {'AffectedArea': df['AffectedArea'].isna().sum()})
+    df['AffectedArea'] = df['AffectedArea'].interpolate(method='linear')
+    
+    # Resetting index if needed
+    df.reset_index(inplace=True)
+    df.rename(columns={'index': 'Date'}, inplace=True)
+    
+    # Round values up to 2 decimal points
+    df['AffectedArea'] = df['AffectedArea'].round(2)
+    
+    return df
+
+
+# Restrict monthly pollution averages to the study window, fill sparse pollutants and round
+def finalize_pollution_data(df):
+    
+    # Filter for the overlapping period
+    df = df[(df['Date'] >= '2013-05-01') & (df['Date'] <= '2018-12-31')]
+    
+    # Fill missing values in TRS, Benzene, and Toluene with 0
+    columns_to_fill = ['TRS', 'Benzene', 'Toluene']
+    log_filled_values('pollution', 'zero_filled', len(df), df[columns_to_fill].isna().sum().to_dict())
+    df[columns_to_fill] = df[columns_to_fill].fillna(0)
+    
+    # Round values up to 2 decimal points
+    numeric_columns = ['PM10', 'TRS', 'O3', 'NO2', 'CO', 'PM2.5', 'SO2', 'Benzene', 'Toluene']
+    df[numeric_columns] = df[numeric_columns].round(2)
+
+    return df.reset_index(drop=True)
+
+
+# Stream the pollution CSV in chunks, keeping only per-day sums and counts in memory
+def clean_pollution_data_chunked(file_path, chunksize=500000, since=None, by_station=False):
+    
+    # Chunks of the raw columns with compact dtypes, checked against the quality rules as they are read
+    reader = checked_chunks(file_path, 'pollution', chunksize=chunksize)
+    return aggregate_pollution_chunks(reader, since=since, by_station=by_station)
+
+
+# Fold raw pollution chunks into monthly means of daily means, restricted to the study window
+# With by_station=True the same pass also builds the per-station table, returned as a second frame
+def aggregate_pollution_chunks(chunks, since=None, by_station=False):
+    pollutant_columns = ['PM10', 'TRS', 'O3', 'NO2', 'CO', 'PM2.5', 'SO2', 'Benzene', 'Toluene']
+    
+    partials = []
+    station_partials = []
+    for chunk in chunks:
+        chunk = chunk.rename(columns=pollution_column_map)
+        chunk['Date'] = pd.to_datetime(chunk['Date'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        
+        # Drop rows without a timestamp or without any pollutant reading
+        chunk = chunk.dropna(subset=['Date'])
+        chunk = chunk.dropna(subset=pollutant_columns, how='all')
+        
+        # Skip readings before the high-water mark in incremental runs
+        if since is not None:
+            chunk = chunk[chunk['Date'] >= since]
+        
+        # Accumulate per-day sums and counts in float64 to avoid float32 rounding drift
+        columns = [chunk[column] for column in pollutant_columns]
+        partials.append(daily_partials(chunk['Date'], columns))
+        if by_station:
+            station_partials.append(daily_partials(chunk['Date'], columns, groups=chunk['id']))
+    
+    if not partials:
+        df = finalize_pollution_data(pd.DataFrame(columns=['Date'] + pollutant_columns))
+    else:
+        # Combine days split across chunks, then average the daily means per month
+        month_codes, monthly_means = monthly_mean_of_daily_means(*merge_partials(partials))
+        df = pd.DataFrame(monthly_means, columns=pollutant_columns)
+        df.insert(0, 'Date', codes_to_timestamps(month_codes, 'M'))
+        df = finalize_pollution_data(df)
+    
+    if not by_station:
+        return df
+    return df, pollution_by_station(station_partials, pollutant_columns)
+
+
+# Long-format monthly pollution averages keyed by (Date, Station), from per-station daily partials
+def pollution_by_station(station_partials, pollutant_columns):
+    station_partials = [partial for partial in station_partials if len(partial[0])]
+    if not station_partials:
+        return pd.DataFrame(columns=['Date', 'Station'] + pollutant_columns)
+    month_codes, monthly_means = monthly_mean_of_daily_means(*merge_partials(station_partials), grouped=True)
+    stations, months = split_codes(month_codes)
+    df = pd.DataFrame(monthly_means, columns=pollutant_columns)
+    df.insert(0, 'Station', stations)
+    df.insert(0, 'Date', codes_to_timestamps(months, 'M'))
+    
+    # Same study window and rounding as the city-wide series, but gaps are left as NaN per station
+    df = df[(df['Date'] >= study_start) & (df['Date'] <= study_end)]
+    df[pollutant_columns] = df[pollutant_columns].round(2)
+    return df.sort_values(['Station', 'Date'], ignore_index=True)
+
+
+# Long-format monthly deforestation totals keyed by (Date, Source), where Source is the alert file (orig_fname)
+def deforestation_by_source(df):
+    df = df[df['data_type'] == 'defor']
+    dates = pd.to_datetime(df['date'], format='%Y/%m/%d %H:%M:%S%z', errors='coerce')
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    keep = dates.notna() & df['ha_eck_iv'].notna() & df['orig_fname'].notna()
+    
+    # One grouped bincount pass over (source, month) codes
+    group_numbers, sources = pd.factorize(df['orig_fname'][keep], sort=True)
+    codes = combine_codes(group_numbers, bucket_codes(dates[keep], 'M'))
+    order = np.argsort(codes, kind='stable')
+    codes, sums, counts = bucket_sums(codes[order], df['ha_eck_iv'][keep].to_numpy(dtype='float64')[order])
+    group_numbers, months = split_codes(codes)
+    result = pd.DataFrame({
+        'Date': codes_to_timestamps(months, 'M'),
+        'Source': np.asarray(sources, dtype=object)[group_numbers],
+        'AffectedArea': sums[:, 0].round(2),
+        'Alerts': counts[:, 0]
+    })
+    result = result[(result['Date'] >= study_start) & (result['Date'] <= study_end)]
+    return result.sort_values(['Source', 'Date'], ignore_index=True)
+
+# A raw source failed its quality rules
+class DataQualityError(ValueError):
+    pass
+
+
+# Running totals of one source's quality checks while its chunks are read
+def start_quality_checks(source, csv_path):
+    return {'source': source, 'path': csv_path, 'rows': 0, 'results': {}, 'seen': {}, 'last': {}}
+
+
+# Add violations of one rule to the totals, remembering the first offending value
+def count_violations(state, rule, field, bad, values, tolerance=None, severity='error'):
+    result = state['results'].setdefault((rule, field), {'violations': 0, 'example': None, 'tolerance': tolerance,
+                                                         'severity': severity})
+    count = int(np.count_nonzero(bad))
+    if count and result['example'] is None:
+        position = int(np.flatnonzero(bad)[0])
+        result['example'] = f"row {state['rows'] + position}: {values[position]}"
+    result['violations'] += count
+
+
+# Type one raw chunk to its schema and check it in a single vectorized pass: dtypes and dates are coerced
+# (counting the values that fail), then ranges, nulls, unique keys and increasing timestamps are counted on the
+# typed columns. Raises DataQualityError as soon as the running totals of an error rule pass their tolerance
+def check_chunk(state, chunk):
+    spec = columnar_sources[state['source']]
+    rules = quality_rules[state['source']]
+    missing = [column for column in rules['required'] if column not in chunk.columns]
+    if missing:
+        raise DataQualityError(f"{state['path']} lacks the required columns {', '.join(missing)}")
+    
+    for column, dtype in spec['dtype'].items():
+        if column not in chunk.columns or dtype == 'string':
+            continue
+        values = pd.to_numeric(chunk[column], errors='coerce')
+        bad = values.isna() & chunk[column].notna()
+        if dtype.lower().startswith('int'):
+            fractional = values.notna() & (values % 1 != 0)
+            values, bad = values.mask(fractional), bad | fractional
+        count_violations(state, 'dtype', column, bad.to_numpy(), chunk[column].to_numpy(), quality_tolerance)
+        chunk[column] = values.astype(dtype)
+    
+    date_column = spec['date_column']
+    dates = pd.to_datetime(chunk[date_column], format=spec['date_format'], errors='coerce')
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    count_violations(state, 'dtype', date_column, (dates.isna() & chunk[date_column].notna()).to_numpy(),
+                     chunk[date_column].to_numpy(), quality_tolerance)
+    chunk[date_column] = dates
+    
+    for column, (low, high) in rules['ranges'].items():
+        if column in chunk.columns:
+            values = chunk[column].to_numpy(dtype='float64', na_value=np.nan)
+            bad = np.zeros(len(values), dtype=bool)
+            if low is not None:
+                bad |= values < low
+            if high is not None:
+                bad |= values > high
+            count_violations(state, 'range', column, bad, values, quality_tolerance)
+    for column, ratio in rules['max_null_ratio'].items():
+        count_violations(state, 'nulls', column, chunk[column].isna().to_numpy(), chunk[column].to_numpy(), ratio)
+    
+    # Keys must not repeat within their group (an ArcGIS objectid is only unique within its layer; exports
+    # without the group column are one group), within the chunk or across the chunks read before it
+    if rules['unique']:
+        rule = rules['unique']
+        column = rule['column']
+        keys = chunk[column].to_numpy(dtype='float64', na_value=np.nan)
+        present = ~np.isnan(keys)
+        keys = keys[present].astype('int64')
+        if rule['by'] in chunk.columns:
+            groups = chunk[rule['by']].fillna('').to_numpy(dtype=object)[present]
+            bad = pd.DataFrame({'group': groups, 'key': keys}).duplicated().to_numpy()
+        else:
+            groups = np.full(len(keys), '', dtype=object)
+            bad = pd.Series(keys).duplicated().to_numpy()
+        for group in pd.unique(groups):
+            in_group = groups == group
+            seen = state['seen'].get(group, np.empty(0, dtype='int64'))
+            bad[in_group] |= np.isin(keys[in_group], seen)
+            state['seen'][group] = np.union1d(seen, keys[in_group])
+        count_violations(state, 'unique', column, bad, keys, 0.0)
+    
+    # Timestamps must increase from row to row within a group, whatever the rows of other groups in between
+    # (a time-major file lists every station each hour). A stable sort by group keeps each group's rows in file
+    # order; each row is compared with the group's previous row, the first with its last time in earlier chunks
+    if rules['increasing']:
+        rule = rules['increasing']
+        valid = (chunk[rule['column']].notna() & chunk[rule['by']].notna()).to_numpy()
+        times = chunk[rule['column']].to_numpy(dtype='datetime64[ns]')[valid].view('int64')
+        groups = chunk[rule['by']].to_numpy(dtype='float64', na_value=np.nan)[valid].astype('int64')
+        order = np.argsort(groups, kind='stable')
+        groups, times = groups[order], times[order]
+        starts = np.ones(len(groups), dtype=bool)
+        starts[1:] = groups[1:] != groups[:-1]
+        earlier_times = np.append(np.iinfo('int64').min, times[:-1])
+        earlier_times[starts] = [state['last'].get(group, np.iinfo('int64').min) for group in groups[starts].tolist()]
+        bad_valid = np.empty(len(groups), dtype=bool)
+        bad_valid[order] = times <= earlier_times
+        bad = np.zeros(len(chunk), dtype=bool)
+        bad[valid] = bad_valid
+        count_violations(state, 'increasing', rule['column'], bad, chunk[rule['column']].to_numpy(),
+                         quality_tolerance, rule['severity'])
+        ends = np.append(starts[1:], True)
+        state['last'].update(zip(groups[ends].tolist(), times[ends].tolist()))
+    
+    state['rows'] += len(chunk)
+    failed = [f"{rule} {field}: {result['violations']} of {state['rows']} rows ({result['example']})"
+              for (rule, field), result in state['results'].items()
+              if result['severity'] == 'error' and result['violations'] > result['tolerance'] * state['rows']]
+    if failed:
+        log_quality_report(state)
+        raise DataQualityError(f"{state['path']} failed its quality checks: " + '; '.join(failed))
+    return chunk
+
+
+# Append the report of a source's checks to the quality log, read into data_quality at the end of the run
+def log_quality_report(state):
+    checked_at = pd.Timestamp.now().isoformat(timespec='seconds')
+    records = []
+    for (rule, field), result in state['results'].items():
+        ratio = result['violations'] / state['rows'] if state['rows'] else 0.0
+        if not result['violations']:
+            status = 'ok'
+        elif result['severity'] == 'error' and ratio > result['tolerance']:
+            status = 'fail'
+        else:
+            status = 'warn'
+        records.append({'run_id': os.getenv('PIPELINE_RUN_ID', 'adhoc'), 'source': state['source'], 'rule': rule,
+                        'field': field, 'rows': state['rows'], 'violations': result['violations'], 'ratio': ratio,
+                        'tolerance': result['tolerance'], 'status': status, 'example': result['example'],
+                        'checked_at': checked_at})
+    os.makedirs(os.path.dirname(quality_log_path), exist_ok=True)
+    with run_log_lock, open(quality_log_path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return records
+
+
+# Count the values a cleaning step filled in rather than read ({field: count}), so they show up in the report
+def log_filled_values(source, rule, rows, filled):
+    state = start_quality_checks(source, None)
+    state['rows'] = rows
+    for field, count in filled.items():
+        state['results'][(rule, field)] = {'violations': int(count), 'example': None, 'tolerance': None, 'severity': 'warn'}
+    log_quality_report(state)
+
+
+# Read a raw source CSV in chunks, typed and checked against its quality rules as each chunk is read
+def checked_chunks(csv_path, source, chunksize=500000):
+    spec = columnar_sources[source]
+    state = start_quality_checks(source, csv_path)
+    # Numeric columns are parsed by pandas and coerced in check_chunk, so a malformed value is counted
+    # instead of failing the whole read
+    reader = pd.read_csv(csv_path, usecols=lambda column: column in spec['dtype'],
+                         dtype={column: dtype for column, dtype in spec['dtype'].items() if dtype == 'string'},
+                         chunksize=chunksize, low_memory=False)
+    for chunk in reader:
+        yield check_chunk(state, chunk)
+    log_quality_report(state)
+    failed = sum(result['violations'] > 0 for result in state['results'].values())
+    print(f"Quality checks of {csv_path}: {state['rows']} rows, {failed} rule(s) with violations")
+
+
+# pyarrow is optional: without it the pipeline parses the raw CSVs directly
+def columnar_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# Convert a raw CSV once into a Parquet dataset partitioned by year/month; reruns only when the CSV changed
+def convert_to_columnar(csv_path, source, chunksize=500000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    spec = columnar_sources[source]
+    target_dir = os.path.join(columnar_dir, source)
+    marker_path = os.path.join(target_dir, '_source.json')
+    checksum = file_checksum(csv_path)
+    if os.path.exists(marker_path):
+        with open(marker_path) as f:
+            if json.load(f).get('checksum') == checksum:
+                return target_dir
+    
+    # Write into a staging directory and swap it in once complete
+    staging_dir = target_dir + '.staging'
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    date_column = spec['date_column']
+    # Optional columns (such as alert locations) are kept only when the export has them; dates are parsed
+    # once while the chunks are checked, so later loads never pay for it again
+    rows = 0
+    for number, chunk in enumerate(checked_chunks(csv_path, source, chunksize=chunksize)):
+        chunk = chunk.dropna(subset=[date_column])
+        if chunk.empty:
+            continue
+        chunk['year'] = chunk[date_column].dt.year.astype('int32')
+        chunk['month'] = chunk[date_column].dt.month.astype('int32')
+        pq.write_to_dataset(pa.Table.from_pandas(chunk, preserve_index=False), staging_dir,
+                            partition_cols=['year', 'month'], basename_template=f'chunk{number:05d}-{{i}}.parquet')
+        rows += len(chunk)
+    
+    with open(os.path.join(staging_dir, '_source.json'), 'w') as f:
+        json.dump({'source': csv_path, 'checksum': checksum, 'rows': rows}, f)
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.replace(staging_dir, target_dir)
+    print(f"Converted {csv_path} into the columnar store ({rows} rows)")
+    return target_dir
+
+
+# Merge an export holding only the rows from `since` onward into the store of the full export: its month
+# partitions replace the stored ones from the month of `since`, older partitions stay as converted
+def merge_columnar_increment(increment_path, source, since, chunksize=500000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    spec = columnar_sources[source]
+    target_dir = os.path.join(columnar_dir, source)
+    staging_dir = target_dir + '.increment'
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    date_column = spec['date_column']
+    rows = 0
+    for number, chunk in enumerate(checked_chunks(increment_path, source, chunksize=chunksize)):
+        chunk = chunk[chunk[date_column] >= since]
+        if chunk.empty:
+            continue
+        chunk['year'] = chunk[date_column].dt.year.astype('int32')
+        chunk['month'] = chunk[date_column].dt.month.astype('int32')
+        pq.write_to_dataset(pa.Table.from_pandas(chunk, preserve_index=False), staging_dir,
+                            partition_cols=['year', 'month'], basename_template=f'increment{number:05d}-{{i}}.parquet')
+        rows += len(chunk)
+    
+    # Drop the stored months from `since` onward, then move the increment's months in
+    for year_name in os.listdir(target_dir):
+        if not year_name.startswith('year='):
+            continue
+        for month_name in os.listdir(os.path.join(target_dir, year_name)):
+            if (int(year_name[5:]), int(month_name[6:])) >= (since.year, since.month):
+                shutil.rmtree(os.path.join(target_dir, year_name, month_name))
+    for year_name in os.listdir(staging_dir):
+        os.makedirs(os.path.join(target_dir, year_name), exist_ok=True)
+        for month_name in os.listdir(os.path.join(staging_dir, year_name)):
+            os.replace(os.path.join(staging_dir, year_name, month_name), os.path.join(target_dir, year_name, month_name))
+    shutil.rmtree(staging_dir)
+    
+    # The marker still matches the full export, so the merged months survive until that export changes
+    marker_path = os.path.join(target_dir, '_source.json')
+    with open(marker_path) as f:
+        marker = json.load(f)
+    marker.setdefault('increments', []).append({'source': increment_path, 'checksum': file_checksum(increment_path),
+                                                'since': since.isoformat(), 'rows': rows})
+    with open(marker_path, 'w') as f:
+        json.dump(marker, f)
+    print(f"Merged {increment_path} into the columnar store ({rows} rows from {since:%Y-%m-%d})")
+    return target_dir
+
+
+# Without pyarrow the raw export is the store: rewrite it with its rows dated before `since` followed by
+# the increment, so every later read sees the full history
+def merge_csv_increment(csv_path, increment_path, source, since, chunksize=500000):
+    spec = columnar_sources[source]
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    part_path = csv_path + '.part'
+    pd.DataFrame(columns=columns).to_csv(part_path, index=False)
+    rows = 0
+    for path in [csv_path, increment_path]:
+        for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize):
+            if path == csv_path:
+                dates = pd.to_datetime(chunk[spec['date_column']], format=spec['date_format'], errors='coerce')
+                if dates.dt.tz is not None:
+                    dates = dates.dt.tz_localize(None)
+                chunk = chunk[~(dates >= since).to_numpy()]
+            chunk.reindex(columns=columns).to_csv(part_path, mode='a', header=False, index=False)
+            rows += len(chunk)
+    os.replace(part_path, csv_path)
+    print(f"Merged {increment_path} into {csv_path} ({rows} rows)")
+    return csv_path
+
+
+# Merge an incremental export into a source's store, the columnar one when available
+def merge_increment(csv_path, increment_path, source, since):
+    if not os.path.exists(csv_path):
+        shutil.copyfile(increment_path, csv_path)
+        return csv_path
+    if not columnar_available():
+        return merge_csv_increment(csv_path, increment_path, source, since)
+    convert_to_columnar(csv_path, source)
+    return merge_columnar_increment(increment_path, source, since)
+
+
+# Partition filter keeping only the year/month directories that overlap [start, end]
+def partition_filter(start, end):
+    import pyarrow.dataset as ds
+    
+    year, month = ds.field('year'), ds.field('month')
+    if start.year == end.year:
+        return (year == start.year) & (month >= start.month) & (month <= end.month)
+    return (
+        ((year > start.year) & (year < end.year))
+        | ((year == start.year) & (month >= start.month))
+        | ((year == end.year) & (month <= end.month))
+    )
+
+
+# Stream selected columns of a columnar source as DataFrames, pruning partitions outside [start, end]
+def load_columnar(source, columns, start=study_start, end=study_end, where=None, batch_size=500000):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    
+    dataset = ds.dataset(os.path.join(columnar_dir, source), format='parquet', partitioning='hive')
+    expression = partition_filter(start, end)
+    if where is not None:
+        expression = expression & where
+    
+    # Partitions hold small per-month files, so regroup their batches into chunks of about batch_size rows
+    pending, rows = [], 0
+    for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=batch_size):
+        pending.append(batch)
+        rows += batch.num_rows
+        if rows >= batch_size:
+            yield pa.Table.from_batches(pending).to_pandas()
+            pending, rows = [], 0
+    if rows:
+        yield pa.Table.from_batches(pending).to_pandas()
+
+
+# Clean the deforestation source, reading the columnar store when available
+# With by_source=True the per-alert-file table is built from the same load and returned as a second frame
+@profiled()
+def clean_deforestation_source(csv_path, since=None, by_source=False):
+    columns = ['date', 'data_type', 'ha_eck_iv'] + (['orig_fname'] if by_source else [])
+    if not columnar_available():
+        df = pd.concat(checked_chunks(csv_path, 'deforestation'), ignore_index=True)[columns]
+    else:
+        import pyarrow.dataset as ds
+        convert_to_columnar(csv_path, 'deforestation')
+        start = study_start if since is None else max(study_start, since)
+        frames = list(load_columnar('deforestation', columns, start=start, where=ds.field('data_type') == 'defor'))
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    
+    cleaned = clean_deforestation_data(df, since=since)
+    if not by_source:
+        return cleaned
+    return cleaned, deforestation_by_source(df)
+
+
+# Clean the pollution source, streaming the columnar store when available
+# With by_station=True the per-station table is built in the same pass and returned as a second frame
+@profiled()
+def clean_pollution_source(csv_path, since=None, by_station=False):
+    if not columnar_available():
+        return clean_pollution_data_chunked(csv_path, since=since, by_station=by_station)
+    
+    convert_to_columnar(csv_path, 'pollution')
+    start = study_start if since is None else max(study_start, since)
+    columns = list(pollution_column_map) + (['id'] if by_station else [])
+    return aggregate_pollution_chunks(load_columnar('pollution', columns, start=start), since=since, by_station=by_station)
+
+
+# Web Mercator (EPSG:3857) coordinates of longitude/latitude degrees
+def lonlat_to_mercator(lon, lat):
+    lon = np.asarray(lon, dtype='float64')
+    lat = np.clip(np.asarray(lat, dtype='float64'), -85.05112878, 85.05112878)
+    x = lon * mercator_half_extent / 180
+    y = np.log(np.tan((90 + lat) * np.pi / 360)) * mercator_half_extent / np.pi
+    return x, y
+
+
+# XYZ tile column and row containing each Web Mercator point (rows grow southward, as in web map tiles)
+def mercator_tiles(x, y, zoom):
+    size = 2 * mercator_half_extent / 2 ** zoom
+    tile_x = np.clip(np.floor((np.asarray(x) + mercator_half_extent) / size), 0, 2 ** zoom - 1).astype('int64')
+    tile_y = np.clip(np.floor((mercator_half_extent - np.asarray(y)) / size), 0, 2 ** zoom - 1).astype('int64')
+    return tile_x, tile_y
+
+
+# Quadtree (Morton) code of a tile: bits of column and row interleaved, so code >> 2 is the parent tile
+def morton_code(tile_x, tile_y):
+    def spread(values):
+        values = np.asarray(values, dtype='uint64') & np.uint64(0xFFFFFFFF)
+        for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                            (2, 0x3333333333333333), (1, 0x5555555555555555)]:
+            values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+        return values
+    return (spread(tile_x) | (spread(tile_y) << np.uint64(1))).astype('int64')
+
+
+# Web Mercator location of each alert from whichever location columns the export carries, or None
+def alert_locations(df):
+    for x_column, y_column, units in location_columns:
+        if x_column in df.columns and y_column in df.columns:
+            x, y = df[x_column].to_numpy(dtype='float64'), df[y_column].to_numpy(dtype='float64')
+            return lonlat_to_mercator(x, y) if units == 'degrees' else (x, y)
+    return None
+
+
+# Build the spatial tile index of deforestation alerts: per-alert locations with their tile, and monthly
+# affected area per (tile, month); returns None when the export carries no location columns
+@profiled()
+def clean_tile_index(csv_path, zoom=None, since=None):
+    zoom = zoom or tile_zoom
+    columns = ['objectid', 'date', 'data_type', 'ha_eck_iv']
+    start = study_start if since is None else max(study_start, since)
+    if not columnar_available():
+        header = pd.read_csv(csv_path, nrows=0).columns
+        location = [column for pair in location_columns for column in pair[:2] if column in header]
+        columns += ['layer'] if 'layer' in header else []
+        df = pd.read_csv(csv_path, usecols=columns + location, dtype={'layer': str})
+        df = df[df['data_type'] == 'defor']
+        df['date'] = pd.to_datetime(df['date'], format='%Y/%m/%d %H:%M:%S%z', errors='coerce').dt.tz_localize(None)
+    else:
+        import pyarrow.dataset as ds
+        convert_to_columnar(csv_path, 'deforestation')
+        stored = ds.dataset(os.path.join(columnar_dir, 'deforestation'), format='parquet', partitioning='hive').schema.names
+        location = [column for pair in location_columns for column in pair[:2] if column in stored]
+        columns += ['layer'] if 'layer' in stored else []
+        frames = list(load_columnar('deforestation', columns + location, start=start,
+                                    where=ds.field('data_type') == 'defor'))
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns + location)
+    
+    locations = alert_locations(df)
+    if locations is None:
+        print("The deforestation export has no location columns, skipping the tile index.")
+        return None
+    
+    # Alerts outside the study window (or before `since`) or without a date, area or location are not indexed
+    x, y = locations
+    keep = (df['date'].notna() & df['ha_eck_iv'].notna() & np.isfinite(x) & np.isfinite(y)
+            & (df['date'] >= start) & (df['date'] < study_end + pd.offsets.MonthBegin(1))).to_numpy()
+    df, x, y = df[keep], x[keep], y[keep]
+    tile_x, tile_y = mercator_tiles(x, y, zoom)
+    tiles = morton_code(tile_x, tile_y)
+    # Alerts are keyed by (layer, objectid); a single export without a layer column is the layer ''
+    alerts = pd.DataFrame({
+        'layer': df['layer'].fillna('').to_numpy(dtype=object) if 'layer' in df.columns else '',
+        'objectid': df['objectid'].to_numpy(),
+        'Date': df['date'].to_numpy(),
+        'Tile': tiles,
+        'TileX': tile_x,
+        'TileY': tile_y,
+        'x': x,
+        'y': y,
+        'AffectedArea': df['ha_eck_iv'].to_numpy(dtype='float64')
+    })
+    
+    # One grouped bincount pass over (tile, month) codes
+    codes = combine_codes(tiles, bucket_codes(alerts['Date'], 'M'))
+    order = np.argsort(codes, kind='stable')
+    codes, sums, counts = bucket_sums(codes[order], alerts['AffectedArea'].to_numpy()[order])
+    tile_codes, months = split_codes(codes)
+    tile_lookup = alerts.drop_duplicates('Tile').set_index('Tile')[['TileX', 'TileY']]
+    monthly = pd.DataFrame({
+        'Tile': tile_codes,
+        'Zoom': zoom,
+        'TileX': tile_lookup['TileX'].reindex(tile_codes).to_numpy(),
+        'TileY': tile_lookup['TileY'].reindex(tile_codes).to_numpy(),
+        'Date': codes_to_timestamps(months, 'M'),
+        'AffectedArea': sums[:, 0],
+        'Alerts': counts[:, 0]
+    })
+    return monthly, alerts.dropna(subset=['objectid'])
+
+
+# Stage: build the tile index once both sources are cleaned, so nothing is saved from a run that failed its checks
+def clean_tiles_stage(fetched, *cleaned):
+    return clean_tile_index(fetched['path'])
+
+
+# Stage: save the tile index tables
+def save_tiles_stage(index):
+    if index is None:
+        return
+    try:
+        tiles, alerts = upsert_tile_index(index)
+        print(f"Tile index saved to warehouse.db ({tiles} tile months, {alerts} alerts)")
+    except sqlite3.Error as e:
+        print(f"Error saving the tile index to SQLite: {e}")
+
+
+# Replace the tile months and alerts from `since` onward (or the whole index) in one transaction, as
+# incremental runs do with the monthly tables. Profiled on its own, so the alert rows it writes are
+# benchmarked apart from the tables saved through replace_table
+@profiled()
+def upsert_tile_index(index, since=None):
+    monthly, alerts = index
+    conn = connect_warehouse()
+    try:
+        with conn:
+            for table, df in [('deforestation_tiles', monthly), ('deforestation_alerts', alerts)]:
+                if since is not None:
+                    conn.execute(f'DELETE FROM "{table}" WHERE Date >= ?', (since.strftime('%Y-%m-%d %H:%M:%S'),))
+                    insert_rows(conn, table, df)
+                else:
+                    # As in replace_table, a full replace builds the secondary index once over the new rows
+                    conn.execute(f'DELETE FROM "{table}"')
+                    conn.execute(f'DROP INDEX IF EXISTS "{index_name(table)}"')
+                    insert_rows(conn, table, df)
+                    create_indexes(conn, table)
+    finally:
+        conn.close()
+    return len(monthly), len(alerts)
+
+
+# Web Mercator bounds of a lon/lat bounding box (west, south, east, north), or of a named study region
+def bbox_bounds(bbox):
+    west, south, east, north = study_regions[bbox] if isinstance(bbox, str) else bbox
+    (x0, x1), (y0, y1) = lonlat_to_mercator([west, east], [south, north])
+    return x0, y0, x1, y1
+
+
+# Monthly affected area and alert count inside a bounding box, answered from the tile index: tiles fully
+# inside the box come from the per-tile aggregates, only alerts in the partially covered edge tiles are read
+@profiled()
+def bbox_monthly_area(bbox, start=None, end=None):
+    x0, y0, x1, y1 = bbox_bounds(bbox)
+    conn = connect_warehouse()
+    try:
+        zoom = conn.execute('SELECT MAX(Zoom) FROM deforestation_tiles').fetchone()[0]
+        if zoom is None:
+            raise ValueError("The tile index is empty; run 'load' on an export with alert locations first.")
+        
+        # Tiles touching the box, and the block of tiles lying entirely inside it
+        size = 2 * mercator_half_extent / 2 ** zoom
+        (tx0, tx1), (ty1, ty0) = mercator_tiles([x0, x1], [y0, y1], zoom)
+        ix0, ix1 = math.ceil((x0 + mercator_half_extent) / size), math.floor((x1 + mercator_half_extent) / size) - 1
+        iy0, iy1 = math.ceil((mercator_half_extent - y1) / size), math.floor((mercator_half_extent - y0) / size) - 1
+        start = (start or study_start).strftime('%Y-%m-%d %H:%M:%S')
+        end = (end or study_end).strftime('%Y-%m-%d %H:%M:%S')
+        
+        inside = pd.read_sql(
+            'SELECT Date, SUM(AffectedArea) AS AffectedArea, SUM(Alerts) AS Alerts FROM deforestation_tiles '
+            'WHERE TileX BETWEEN ? AND ? AND TileY BETWEEN ? AND ? AND Date BETWEEN ? AND ? GROUP BY Date',
+            conn, params=(ix0, ix1, iy0, iy1, start, end))
+        edge = pd.read_sql(
+            "SELECT substr(Date, 1, 7) || '-01 00:00:00' AS Date, SUM(AffectedArea) AS AffectedArea, COUNT(*) AS Alerts "
+            'FROM deforestation_alerts WHERE TileX BETWEEN ? AND ? AND TileY BETWEEN ? AND ? '
+            'AND NOT (TileX BETWEEN ? AND ? AND TileY BETWEEN ? AND ?) '
+            'AND x BETWEEN ? AND ? AND y BETWEEN ? AND ? GROUP BY 1',
+            conn, params=(int(tx0), int(tx1), int(ty0), int(ty1), ix0, ix1, iy0, iy1, x0, x1, y0, y1))
+    finally:
+        conn.close()
+    
+    edge = edge[(edge['Date'] >= start) & (edge['Date'] <= end)]
+    frames = [frame for frame in (inside, edge) if not frame.empty]
+    if not frames:
+        return pd.DataFrame({'Date': pd.Series(dtype='datetime64[ns]'), 'AffectedArea': pd.Series(dtype='float64'),
+                             'Alerts': pd.Series(dtype='int64')})
+    df = pd.concat(frames).groupby('Date', as_index=False).sum()
+    df['Date'] = pd.to_datetime(df['Date'])
+    df['AffectedArea'] = df['AffectedArea'].round(2)
+    df['Alerts'] = df['Alerts'].astype('int64')
+    return df.sort_values('Date', ignore_index=True)
+
+
+# SHA-256 checksum of a file, read in blocks
+def file_checksum(file_path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Create the table holding per-source high-water marks
+def ensure_state_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_state (
+            source TEXT PRIMARY KEY,
+            last_date TEXT,
+            etag TEXT,
+            checksum TEXT,
+            updated_at TEXT,
+            last_modified TEXT
+        )
+    """)
+    
+    # Databases written before Last-Modified was tracked lack the column
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(pipeline_state)")]
+    if 'last_modified' not in columns:
+        conn.execute("ALTER TABLE pipeline_state ADD COLUMN last_modified TEXT")
+
+
+# Typed warehouse tables as {table: (columns with SQLite types, primary key)}; every table is keyed on Date
+warehouse_pollutants = [(pollutant, 'REAL') for pollutant in ['PM10', 'TRS', 'O3', 'NO2', 'CO', 'PM2.5', 'SO2', 'Benzene', 'Toluene']]
+warehouse_tables = {
+    'deforestation': ([('Date', 'TEXT NOT NULL'), ('AffectedArea', 'REAL')], ['Date']),
+    'pollution': ([('Date', 'TEXT NOT NULL')] + warehouse_pollutants, ['Date']),
+    'merged_monthly': ([('Date', 'TEXT NOT NULL'), ('AffectedArea', 'REAL')] + warehouse_pollutants, ['Date']),
+    'deforestation_by_source': ([('Date', 'TEXT NOT NULL'), ('Source', 'TEXT NOT NULL'), ('AffectedArea', 'REAL'),
+                                 ('Alerts', 'INTEGER')], ['Source', 'Date']),
+    'pollution_by_station': ([('Date', 'TEXT NOT NULL'), ('Station', 'INTEGER NOT NULL')] + warehouse_pollutants,
+                             ['Station', 'Date']),
+    'correlation_results': ([('x', 'TEXT NOT NULL'), ('y', 'TEXT NOT NULL'), ('n', 'INTEGER')]
+                            + [(statistic, 'REAL') for statistic in [
+                                'pearson', 'pearson_p', 'spearman', 'spearman_p', 'kendall', 'kendall_p',
+                                'slope', 'intercept', 'r_squared', 'slope_p', 'intercept_p']]
+                            + [(f'{statistic}_ci_{bound}', 'REAL') for statistic in ['pearson', 'spearman', 'kendall', 'slope']
+                               for bound in ['low', 'high']]
+                            + [('computed_at', 'TEXT')], ['x', 'y']),
+    'lag_correlations': ([('Resolution', 'TEXT NOT NULL'), ('Scope', 'TEXT NOT NULL'), ('Key', 'INTEGER NOT NULL'),
+                          ('Pollutant', 'TEXT NOT NULL'), ('Lag', 'INTEGER NOT NULL'), ('n', 'INTEGER'),
+                          ('pearson', 'REAL'), ('computed_at', 'TEXT')],
+                         ['Resolution', 'Scope', 'Key', 'Pollutant', 'Lag']),
+    'rolling_correlations': ([('Resolution', 'TEXT NOT NULL'), ('Scope', 'TEXT NOT NULL'), ('Key', 'INTEGER NOT NULL'),
+                              ('Pollutant', 'TEXT NOT NULL'), ('Lag', 'INTEGER'), ('Window', 'INTEGER'),
+                              ('Date', 'TEXT NOT NULL'), ('n', 'INTEGER'), ('pearson', 'REAL'), ('computed_at', 'TEXT')],
+                             ['Resolution', 'Scope', 'Key', 'Pollutant', 'Date']),
+    'data_quality': ([('run_id', 'TEXT NOT NULL'), ('source', 'TEXT NOT NULL'), ('rule', 'TEXT NOT NULL'),
+                      ('field', 'TEXT NOT NULL'), ('rows', 'INTEGER'), ('violations', 'INTEGER'), ('ratio', 'REAL'),
+                      ('tolerance', 'REAL'), ('status', 'TEXT'), ('example', 'TEXT'), ('checked_at', 'TEXT')],
+                     ['run_id', 'source', 'rule', 'field']),
+    'pipeline_runs': ([('run_id', 'TEXT NOT NULL'), ('seq', 'INTEGER NOT NULL'), ('stage', 'TEXT'), ('pid', 'INTEGER'),
+                       ('started_at', 'TEXT'), ('wall_seconds', 'REAL'), ('cpu_seconds', 'REAL'),
+                       ('peak_rss_bytes', 'INTEGER'), ('rows_in', 'INTEGER'), ('rows_out', 'INTEGER'),
+                       ('bytes_read', 'INTEGER'), ('bytes_written', 'INTEGER'), ('status', 'TEXT'), ('error', 'TEXT')],
+                      ['run_id', 'seq']),
+    'deforestation_tiles': ([('Tile', 'INTEGER NOT NULL'), ('Zoom', 'INTEGER'), ('TileX', 'INTEGER'), ('TileY', 'INTEGER'),
+                             ('Date', 'TEXT NOT NULL'), ('AffectedArea', 'REAL'), ('Alerts', 'INTEGER')], ['Tile', 'Date']),
+    'deforestation_alerts': ([('layer', 'TEXT NOT NULL'), ('objectid', 'INTEGER NOT NULL'), ('Date', 'TEXT'),
+                              ('Tile', 'INTEGER'), ('TileX', 'INTEGER'), ('TileY', 'INTEGER'), ('x', 'REAL'), ('y', 'REAL'),
+                              ('AffectedArea', 'REAL')], ['layer', 'objectid'])
+}
+
+# Rollup cube over AffectedArea and every pollutant: periods of each level are keyed by their first day
+rollup_measures = ['AffectedArea'] + [column for column, _ in warehouse_pollutants]
+rollup_levels = {'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+# Start of each level's period as stored 'YYYY-MM-DD HH:MM:SS' text, from a stored Date
+rollup_period_starts = {
+    'month': "substr(Date, 1, 7) || '-01 00:00:00'",
+    'quarter': "printf('%s-%02d-01 00:00:00', substr(Date, 1, 4), (CAST(substr(Date, 6, 2) AS INTEGER) - 1) / 3 * 3 + 1)",
+    'year': "substr(Date, 1, 4) || '-01-01 00:00:00'"
+}
+warehouse_tables['monthly_rollup'] = (
+    [('Level', 'TEXT NOT NULL'), ('Date', 'TEXT NOT NULL')]
+    + [(f'{measure}_{statistic}', 'INTEGER' if statistic.endswith('count') else 'REAL')
+       for measure in rollup_measures for statistic in ['sum', 'count', 'prefix_sum', 'prefix_count']],
+    ['Level', 'Date']
+)
+
+# Secondary indexes: tile row/column ranges answer bounding box queries
+warehouse_indexes = {
+    'deforestation_tiles': ['TileX', 'TileY', 'Date'],
+    'deforestation_alerts': ['TileX', 'TileY']
+}
+
+
+# Open the warehouse in WAL mode so readers are not blocked while a load is running, creating missing tables
+def connect_warehouse():
+    conn = sqlite3.connect(warehouse_db_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # Alert tables written before alerts were keyed by their layer are dropped; the next full load rebuilds them
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(deforestation_alerts)")]
+    if columns and 'layer' not in columns:
+        conn.execute("DROP TABLE deforestation_alerts")
+    for table, (columns, primary_key) in warehouse_tables.items():
+        definitions = ', '.join(f'"{column}" {column_type}' for column, column_type in columns)
+        key = ', '.join(f'"{column}"' for column in primary_key)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({definitions}, PRIMARY KEY ({key}))')
+    for table in warehouse_indexes:
+        create_indexes(conn, table)
+    ensure_state_table(conn)
+    conn.commit()
+    return conn
+
+
+# Values of one column as Python objects SQLite binds, missing values as None; dates become sortable
+# 'YYYY-MM-DD HH:MM:SS' text, formatted by numpy rather than strftime
+def sql_values(series, as_date=False):
+    if as_date:
+        dates = pd.to_datetime(series).to_numpy().astype('datetime64[s]')
+        text = np.datetime_as_string(dates, unit='s').astype('U19')
+        text.view('U1').reshape(len(text), 19)[:, 10] = ' '
+        values, missing = text.astype(object), np.isnat(dates)
+    else:
+        values = series.to_numpy()
+        if values.dtype.kind in 'iub':
+            return values.tolist()
+        missing = np.isnan(values) if values.dtype.kind == 'f' else pd.isna(values)
+        values = values.astype(object) if values.dtype.kind == 'f' else series.astype(object).to_numpy()
+    values[missing] = None
+    return values.tolist()
+
+
+# Name of a table's secondary index
+def index_name(table):
+    return f'idx_{table}_{"_".join(warehouse_indexes[table]).lower()}'
+
+
+# Create a table's secondary index unless it exists
+def create_indexes(conn, table):
+    if table in warehouse_indexes:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name(table)}" ON "{table}" ({", ".join(warehouse_indexes[table])})')
+
+
+# Bulk insert a frame with executemany, converting it column by column in batches of rows so that only one
+# batch of Python values is alive at a time; dates are stored as sortable 'YYYY-MM-DD HH:MM:SS' text
+def insert_rows(conn, table, df, batch_rows=100000):
+    if df.empty:
+        return 0
+    # Rows go in primary key order, so SQLite appends to its B-tree instead of splitting pages all over it
+    primary_key = [column for column in warehouse_tables[table][1] if column in df.columns]
+    if primary_key:
+        df = df.sort_values(primary_key, kind='stable')
+    columns = ', '.join(f'"{column}"' for column in df.columns)
+    placeholders = ', '.join('?' * len(df.columns))
+    for start in range(0, len(df), batch_rows):
+        batch = df.iloc[start:start + batch_rows]
+        values = [sql_values(batch[column], as_date=column == 'Date') for column in df.columns]
+        conn.executemany(f'INSERT OR REPLACE INTO "{table}" ({columns}) VALUES ({placeholders})', zip(*values))
+    return len(df)
+
+
+# Rebuild the merged deforestation and pollution table from the two monthly tables
+def refresh_merged_monthly(conn):
+    pollutants = ', '.join(f'p."{column}"' for column, _ in warehouse_pollutants)
+    conn.execute('DELETE FROM merged_monthly')
+    conn.execute(f'INSERT INTO merged_monthly SELECT d.Date, d.AffectedArea, {pollutants} '
+                 'FROM deforestation d JOIN pollution p ON p.Date = d.Date')
+
+
+# Rebuild the month/quarter/year rollup of AffectedArea and every pollutant: per-period sums and counts of
+# the monthly values plus their running (prefix) totals, so any period range is two row lookups. The tables
+# hold a few hundred months, so this runs inside SQLite rather than paying for a round trip through pandas
+# on every replace_table
+def refresh_rollups(conn):
+    measures = [(f'd."{measure}"' if measure == 'AffectedArea' else f'p."{measure}"', measure) for measure in rollup_measures]
+    columns = ['Level', 'Date'] + [f'"{measure}_{statistic}"' for measure in rollup_measures
+                                   for statistic in ['sum', 'count', 'prefix_sum', 'prefix_count']]
+    monthly = ', '.join(f'{source} AS "{measure}"' for source, measure in measures)
+    periods = ', '.join(f'SUM("{measure}") AS "{measure}_sum", COUNT("{measure}") AS "{measure}_count"'
+                        for measure in rollup_measures)
+    totals = ', '.join(f'"{measure}_sum", "{measure}_count", SUM(COALESCE("{measure}_sum", 0)) OVER running, '
+                       f'SUM("{measure}_count") OVER running' for measure in rollup_measures)
+    
+    conn.execute('DELETE FROM monthly_rollup')
+    for level, period in rollup_period_starts.items():
+        conn.execute(
+            f'INSERT INTO monthly_rollup ({", ".join(columns)}) '
+            f'WITH dates AS (SELECT Date FROM deforestation UNION SELECT Date FROM pollution), '
+            f'monthly AS (SELECT dates.Date, {monthly} FROM dates '
+            f'LEFT JOIN deforestation d ON d.Date = dates.Date LEFT JOIN pollution p ON p.Date = dates.Date), '
+            f'periods AS (SELECT {period} AS Date, {periods} FROM monthly GROUP BY 1) '
+            f'SELECT ?, Date, {totals} FROM periods WINDOW running AS (ORDER BY Date)',
+            (level,)
+        )
+
+
+# Running totals of a measure up to the last period before (strictly=True) or at `period`
+def rollup_prefix(conn, measure, level, period, strictly=False):
+    row = conn.execute(
+        f'SELECT "{measure}_prefix_sum", "{measure}_prefix_count" FROM monthly_rollup '
+        f'WHERE Level = ? AND Date {"<" if strictly else "<="} ? ORDER BY Date DESC LIMIT 1',
+        (level, period.strftime('%Y-%m-%d %H:%M:%S'))
+    ).fetchone()
+    return row if row is not None else (0.0, 0)
+
+
+# Sum, count of months (or periods) with data and mean of a measure from `start` to `end` inclusive, at the
+# given rollup level; answered from two prefix lookups whatever the length of the range
+def rollup_range(measure, start, end, level='month'):
+    if measure not in rollup_measures:
+        raise ValueError(f"Unknown measure '{measure}', expected one of {', '.join(rollup_measures)}")
+    frequency = rollup_levels[level]
+    start = pd.Timestamp(start).to_period(frequency).start_time
+    end = pd.Timestamp(end).to_period(frequency).start_time
+    if start > end:
+        raise ValueError(f"The range starts on {start:%Y-%m-%d}, after its end on {end:%Y-%m-%d}")
+    conn = connect_warehouse()
+    try:
+        end_sum, end_count = rollup_prefix(conn, measure, level, end)
+        start_sum, start_count = rollup_prefix(conn, measure, level, start, strictly=True)
+    finally:
+        conn.close()
+    total, count = end_sum - start_sum, end_count - start_count
+    return {'measure': measure, 'level': level, 'start': start, 'end': end,
+            'sum': round(total, 2), 'count': count, 'mean': round(total / count, 2) if count else None}
+
+
+# Replace a whole table in one transaction, optionally moving a source's high-water mark with it
+@profiled()
+def replace_table(table, df, watermark=None):
+    conn = connect_warehouse()
+    try:
+        with conn:
+            # A secondary index is built once over the new rows rather than maintained row by row
+            conn.execute(f'DELETE FROM "{table}"')
+            if table in warehouse_indexes:
+                conn.execute(f'DROP INDEX IF EXISTS "{index_name(table)}"')
+            count = insert_rows(conn, table, df)
+            create_indexes(conn, table)
+            if watermark is not None:
+                write_watermark(conn, **watermark)
+            if table in ('deforestation', 'pollution'):
+                refresh_merged_monthly(conn)
+                refresh_rollups(conn)
+    finally:
+        conn.close()
+    return count
+
+
+# Read the stored high-water mark of a source, or None on the first run
+def read_watermark(source):
+    if not os.path.exists(warehouse_db_path):
+        return None
+    conn = connect_warehouse()
+    try:
+        row = conn.execute("SELECT last_date, etag, checksum, last_modified FROM pipeline_state WHERE source = ?", (source,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {'last_date': pd.Timestamp(row[0]) if row[0] else None, 'etag': row[1], 'checksum': row[2], 'last_modified': row[3]}
+
+
+# Record the high-water mark of a source as part of the caller's transaction
+def write_watermark(conn, source, last_date, etag=None, checksum=None, last_modified=None):
+    last_date = None if pd.isna(last_date) else pd.Timestamp(last_date).strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute(
+        "INSERT OR REPLACE INTO pipeline_state (source, last_date, etag, checksum, updated_at, last_modified) VALUES (?, ?, ?, ?, ?, ?)",
+        (source, last_date, etag, checksum, pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'), last_modified)
+    )
+
+
+# Replace the stored months from `since` onward (or the whole table) and move the high-water mark, in one transaction
+@profiled()
+def upsert_months(table, df, source, since=None, etag=None, checksum=None, last_modified=None):
+    if since is not None:
+        df = df[df['Date'] >= since]
+    conn = connect_warehouse()
+    try:
+        with conn:
+            # Leave stored months alone when nothing was recomputed
+            if not df.empty:
+                if since is not None:
+                    conn.execute(f'DELETE FROM "{table}" WHERE Date >= ?', (since.strftime('%Y-%m-%d %H:%M:%S'),))
+                else:
+                    conn.execute(f'DELETE FROM "{table}"')
+                insert_rows(conn, table, df)
+                refresh_merged_monthly(conn)
+                refresh_rollups(conn)
+            last_date = conn.execute(f'SELECT MAX(Date) FROM "{table}"').fetchone()[0]
+            write_watermark(conn, source, last_date, etag, checksum, last_modified)
+    finally:
+        conn.close()
+    return len(df)
+
+
+# Re-fill any month gap between stored deforestation history and recomputed months
+def merge_deforestation_history(df, since):
+    conn = connect_warehouse()
+    try:
+        history = pd.read_sql('SELECT Date, AffectedArea FROM deforestation WHERE Date < ?', conn,
+                              params=(since.strftime('%Y-%m-%d %H:%M:%S'),), parse_dates=['Date'])
+    finally:
+        conn.close()
+    if history.empty or df.empty:
+        return df
     
-    # Standardize the time format
-    df['Date'] = pd.to_datetime(df['Date'], format='%Y/%m/%d %H:%M:%S%z', errors='coerce')
-    df['Date'] = df['Date'].dt.tz_localize(None) # Remove timezone information
+    # Interpolate only across the months that are new; stored values are left untouched
+    combined = pd.concat([history, df]).set_index('Date').sort_index()
+    combined = combined.reindex(pd.date_range(start=combined.index.min(), end=combined.index.max(), freq='MS'))
+    combined['AffectedArea'] = combined['AffectedArea'].interpolate(method='linear').round(2)
+    combined = combined.rename_axis('Date').reset_index()
+    return combined[combined['Date'] >= since].reset_index(drop=True)
+
+
+# Incremental run: only months from each source's high-water mark onward are recomputed and upserted
+def run_incremental(offline=False):
+    deforestation_path = os.path.join(data_dir, "deforestation.csv")
+    # An export filtered on the high-water mark goes to its own file and is merged into the store, so the full
+    # export and everything read from it (cleaning, the tile index, daily lags) keep the months before it
+    increment_path = os.path.join(data_dir, "deforestation_increment.csv")
+    deforestation_state = read_watermark('deforestation') or {}
+    pollution_state = read_watermark('pollution') or {}
+    deforestation_since = deforestation_state.get('last_date')
+    pollution_since = pollution_state.get('last_date')
     
-    # Sort ascendingly by time
-    df = df.sort_values(by='Date', ascending=True)
+    # Fetch the sources; the ArcGIS query only asks for alerts from the high-water month onward
+    etag = last_modified = None
+    download_path = deforestation_path if deforestation_since is None else increment_path
+    if os.getenv('USE_MOCK_DATA') == 'true':
+        create_mock_data(**mock_scales[mock_scale])
+        changed = True
+        download_path = deforestation_path
+        pollution_data_path = os.path.join(data_dir, "cetesb.csv", "cetesb.csv")
+    elif load_deforestation_sources():
+        changed, etag, last_modified = download_arcgis_sources(load_deforestation_sources(), download_path,
+                                                               since=deforestation_since, offline=offline)
+        pollution_data_path = download_pollution_data(offline=offline)
+    else:
+        url = deforestation_url_since(deforestation_since) if deforestation_since is not None else deforestation_url
+        changed, etag, last_modified = download_data(url, download_path, etag=deforestation_state.get('etag'),
+                                                     last_modified=deforestation_state.get('last_modified'),
+                                                     offline=offline)
+        pollution_data_path = download_pollution_data(offline=offline)
     
-    # Drop rows with missing values
-    df = df.dropna(subset=['Date', 'AffectedArea'])
+    # Both sources are checked and cleaned before anything is written, so a DataQualityError in either leaves the
+    # warehouse as it was; a merged increment is merged again on the next run, from the same high-water mark
+    deforestation_df = pollution_df = None
+    if changed and os.path.exists(download_path):
+        deforestation_checksum = file_checksum(download_path)
+        if deforestation_checksum == deforestation_state.get('checksum'):
+            print("Deforestation source unchanged, nothing to update.")
+        else:
+            if download_path == increment_path:
+                merge_increment(deforestation_path, increment_path, 'deforestation', deforestation_since)
+            deforestation_df = clean_deforestation_source(deforestation_path, since=deforestation_since)
+            if deforestation_since is not None:
+                deforestation_df = merge_deforestation_history(deforestation_df, deforestation_since)
+            # The tile index is rebuilt from the same months, so area queries agree with the monthly table
+            index = clean_tile_index(deforestation_path, since=deforestation_since)
+    if pollution_data_path:
+        pollution_checksum = file_checksum(pollution_data_path)
+        if pollution_checksum == pollution_state.get('checksum'):
+            print("Pollution source unchanged, nothing to update.")
+        else:
+            pollution_df = clean_pollution_source(pollution_data_path, since=pollution_since)
     
-    # Aggregate by summing AffectedArea per month
-    df = df.groupby(df['Date'].dt.to_period('M')).agg({'AffectedArea': 'sum'}).reset_index()
-    df['Date'] = df['Date'].dt.to_timestamp()  # Convert period back to timestamp
+    # Deforestation: upsert the months from the high-water mark and the tile index built from them
+    if deforestation_df is not None:
+        count = upsert_months("deforestation", deforestation_df, 'deforestation', since=deforestation_since,
+                              etag=etag, checksum=deforestation_checksum, last_modified=last_modified)
+        print(f"Upserted {count} deforestation months into warehouse.db")
+        if index is not None:
+            tiles, alerts = upsert_tile_index(index, since=deforestation_since)
+            print(f"Upserted {tiles} tile months and {alerts} alerts into the tile index")
     
-    # Filter for the overlapping period
-    df = df[(df['Date'] >= '2013-05-01') & (df['Date'] <= '2018-12-31')]
+    # Pollution: upsert the months from the high-water mark
+    if pollution_df is not None:
+        count = upsert_months("pollution", pollution_df, 'pollution', since=pollution_since, checksum=pollution_checksum)
+        print(f"Upserted {count} pollution months into warehouse.db")
     
-    # Setting the date as the index
-    df.set_index('Date', inplace=True)
+    print("Incremental pipeline run complete.")
+
+
+# Merge the monthly series on Date, AffectedArea first; months missing a pollutant stay as NaN
+def merged_analysis_frame(deforestation_df, pollution_df):
+    merged_df = pd.merge(deforestation_df, pollution_df, on="Date", how="inner")
+    columns = ["AffectedArea"] + [col for col in merged_df.columns if col != "Date" and col != "AffectedArea"]
+    return merged_df[columns].astype('float64')
+
+
+# Per-column tie statistics used by Kendall's tau-b and its asymptotic variance
+def tie_statistics(values):
+    ties = np.zeros((3, values.shape[1]))
+    for column in range(values.shape[1]):
+        counts = np.unique(values[:, column], return_counts=True)[1].astype('float64')
+        counts = counts[counts > 1]
+        ties[:, column] = [
+            (counts * (counts - 1) / 2).sum(),
+            (counts * (counts - 1) * (counts - 2)).sum(),
+            (counts * (counts - 1) * (2 * counts + 5)).sum()
+        ]
+    return ties
+
+
+# Two-sided p-values for correlation coefficients through the t distribution with n - 2 degrees of freedom
+def correlation_p_values(r, n):
+    from scipy.stats import t as t_dist
     
-    # Reindex to fill missing months
-    all_dates = pd.date_range(start=df.index.min(), end=df.index.max(), freq='MS')  # Monthly start frequency
-    df = df.reindex(all_dates)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_stat = r * np.sqrt((n - 2) / (1 - r ** 2))
+    return 2 * t_dist.sf(np.abs(t_stat), n - 2)
+
+
+# Pearson, Spearman and Kendall matrices plus OLS fits of every column on every other column
+# Everything comes from one standardized matrix, one rank transform and one pairwise sign matrix
+def correlation_matrices(values, with_p_values=True):
+    from scipy.stats import norm, rankdata, t as t_dist
     
-    # Interpolate missing values linearly
-    df['AffectedArea'] = df['AffectedArea'].interpolate(method='linear')
+    n = values.shape[0]
+    means = values.mean(axis=0)
+    centered = values - means
+    sum_squares = (centered ** 2).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        standardized = centered / np.sqrt(sum_squares)
+        pearson = np.clip(standardized.T @ standardized, -1, 1)
+        
+        # Spearman is Pearson on the (average-tie) ranks
+        ranks = rankdata(values, axis=0)
+        ranks -= ranks.mean(axis=0)
+        ranks /= np.sqrt((ranks ** 2).sum(axis=0))
+        spearman = np.clip(ranks.T @ ranks, -1, 1)
+        
+        # Kendall's tau-b: concordant minus discordant pairs is the dot product of pairwise signs
+        first, second = np.triu_indices(n, k=1)
+        signs = np.sign(values[second] - values[first])
+        con_minus_dis = signs.T @ signs
+        untied = np.diag(con_minus_dis)
+        kendall = np.clip(con_minus_dis / np.sqrt(np.outer(untied, untied)), -1, 1)
+        
+        # OLS of column j on column i (row i is the regressor), in closed form from the same cross products
+        slope = (centered.T @ centered) / sum_squares[:, None]
+        intercept = means[None, :] - slope * means[:, None]
     
-    # Resetting index if needed
-    df.reset_index(inplace=True)
-    df.rename(columns={'index': 'Date'}, inplace=True)
+    result = {'n': n, 'pearson': pearson, 'spearman': spearman, 'kendall': kendall,
+              'slope': slope, 'intercept': intercept, 'r_squared': pearson ** 2}
+    if not with_p_values:
+        return result
     
-    # Round values up to 2 decimal points
-    df['AffectedArea'] = df['AffectedArea'].round(2)
+    # Asymptotic Kendall p-values with the tie-corrected variance used by scipy.stats.kendalltau
+    ties = tie_statistics(values)
+    m = n * (n - 1.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = ((m * (2 * n + 5) - ties[2][:, None] - ties[2][None, :]) / 18
+                    + 2 * np.outer(ties[0], ties[0]) / m
+                    + np.outer(ties[1], ties[1]) / (9 * m * (n - 2)))
+        kendall_p = 2 * norm.sf(np.abs(con_minus_dis / np.sqrt(variance)))
+        
+        # Standard error of the intercept: s * sqrt(1/n + mean_x^2 / Sxx) with s from the residual sum of squares
+        residual_variance = sum_squares[None, :] * (1 - pearson ** 2) / (n - 2)
+        intercept_se = np.sqrt(residual_variance * (1 / n + means[:, None] ** 2 / sum_squares[:, None]))
+        intercept_p = 2 * t_dist.sf(np.abs(intercept / intercept_se), n - 2)
     
-    return df
+    # The slope t statistic equals the Pearson t statistic for a simple regression
+    result.update({
+        'pearson_p': correlation_p_values(pearson, n),
+        'spearman_p': correlation_p_values(spearman, n),
+        'kendall_p': kendall_p,
+        'slope_p': correlation_p_values(pearson, n),
+        'intercept_p': intercept_p
+    })
+    return result
 
 
-# Apply transformations to pollution dataset
-def clean_pollution_data(df):
-    
-    # Change column names and align pollutant names with standard names
-    df = df.rename(columns={df.columns[0]: 'No.', 'time': 'Date', 'id': 'ID', 'MP10': 'PM10', 'MP2.5': 'PM2.5', 'BENZENO': 'Benzene', 'TOLUENO': 'Toluene'})
+# Statistics returned by correlation_matrices, without and with p-values
+correlation_statistics = ['pearson', 'spearman', 'kendall', 'slope', 'intercept', 'r_squared']
+correlation_p_statistics = ['pearson_p', 'spearman_p', 'kendall_p', 'slope_p', 'intercept_p']
+
+
+# correlation_matrices over pairwise-complete rows, as DataFrame.corr computes them: the columns without gaps
+# share one pass over every row, and each pair involving a column with gaps is computed on the rows where both
+# of its columns are present. n becomes a matrix of those row counts; pairs with fewer than 3 rows stay NaN
+def pairwise_correlation_matrices(values, with_p_values=True):
+    present = ~np.isnan(values)
+    columns = values.shape[1]
+    complete = np.flatnonzero(present.all(axis=0))
+    subsets = [(complete, slice(None))] if len(complete) else []
+    for i in range(columns):
+        for j in range(i + 1, columns):
+            if not (present[:, i].all() and present[:, j].all()):
+                subsets.append((np.array([i, j]), present[:, i] & present[:, j]))
     
-    # Keep relevant columns only and standardize the time format
-    df = df[['Date', 'PM10', 'TRS', 'O3', 'NO2', 'CO', 'PM2.5', 'SO2', 'Benzene', 'Toluene']]
-    df['Date'] = pd.to_datetime(df['Date'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    statistics = correlation_statistics + (correlation_p_statistics if with_p_values else [])
+    result = {statistic: np.full((columns, columns), np.nan) for statistic in statistics}
+    result['n'] = np.zeros((columns, columns), dtype='int64')
+    for index, rows in subsets:
+        subset = values[rows][:, index]
+        cells = np.ix_(index, index)
+        result['n'][cells] = len(subset)
+        if len(subset) < 3:
+            continue
+        matrices = correlation_matrices(subset, with_p_values=with_p_values)
+        for statistic in statistics:
+            result[statistic][cells] = matrices[statistic]
+    return result
+
+
+# Coefficients that get bootstrap confidence intervals
+bootstrap_statistics = ['pearson', 'spearman', 'kendall', 'slope']
+
+
+# Recompute the coefficients on bootstrap resamples of the rows
+def bootstrap_correlations(values, resamples, seed):
+    rng = np.random.default_rng(seed)
+    samples = {statistic: [] for statistic in bootstrap_statistics}
+    for _ in range(resamples):
+        matrices = pairwise_correlation_matrices(values[rng.integers(0, len(values), len(values))],
+                                                 with_p_values=False)
+        for statistic in bootstrap_statistics:
+            samples[statistic].append(matrices[statistic])
+    return {statistic: np.stack(stacked) for statistic, stacked in samples.items()}
+
+
+# Percentile bootstrap confidence intervals, split into batches across a process pool
+def bootstrap_intervals(values, resamples=1000, confidence=0.95, workers=None, seed=0):
+    workers = workers or os.cpu_count() or 1
+    batch_sizes = [len(batch) for batch in np.array_split(np.arange(resamples), workers) if len(batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    with process_pool(len(batch_sizes)) as pool:
+        batches = list(pool.map(bootstrap_correlations, [values] * len(batch_sizes), batch_sizes, seeds))
     
-    # Drop rows with all empty pollutants data
-    pollutant_columns = ['PM10', 'TRS', 'O3', 'NO2', 'CO', 'PM2.5', 'SO2', 'Benzene', 'Toluene']
-    df = df.dropna(subset=pollutant_columns, how='all')
+    tail = (1 - confidence) / 2 * 100
+    intervals = {}
+    for statistic in bootstrap_statistics:
+        samples = np.concatenate([batch[statistic] for batch in batches])
+        intervals[statistic] = np.nanpercentile(samples, [tail, 100 - tail], axis=0)
+    return intervals
+
+
+# Long-format table of every ordered column pair: (x, y) holds the correlations and the fit of y on x
+@profiled()
+def correlation_results(deforestation_df, pollution_df, bootstrap=0, confidence=0.95):
+    merged_df = merged_analysis_frame(deforestation_df, pollution_df)
+    columns = list(merged_df.columns)
+    values = merged_df.to_numpy()
+    matrices = pairwise_correlation_matrices(values)
     
-    # Ensure pollutant columns are numeric
-    df[pollutant_columns] = df[pollutant_columns].apply(pd.to_numeric, errors='coerce')
+    x_index, y_index = np.nonzero(~np.eye(len(columns), dtype=bool))
+    results = pd.DataFrame({
+        'x': np.asarray(columns)[x_index],
+        'y': np.asarray(columns)[y_index],
+        'n': matrices['n'][x_index, y_index]
+    })
+    for statistic in ['pearson', 'pearson_p', 'spearman', 'spearman_p', 'kendall', 'kendall_p',
+                      'slope', 'intercept', 'r_squared', 'slope_p', 'intercept_p']:
+        results[statistic] = matrices[statistic][x_index, y_index]
     
-    # Get an average by averaging per day
-    df = df.groupby(df['Date'].dt.to_period('D')).mean(numeric_only=True).reset_index()
-    df['Date'] = df['Date'].dt.to_timestamp() # Convert period back to timestamp
+    if bootstrap:
+        intervals = bootstrap_intervals(values, resamples=bootstrap, confidence=confidence)
+        for statistic, (low, high) in intervals.items():
+            results[f'{statistic}_ci_low'] = low[x_index, y_index]
+            results[f'{statistic}_ci_high'] = high[x_index, y_index]
+    return results
+
+
+# Replace the correlation_results table with the latest run
+def save_correlation_results(results):
+    try:
+        replace_table("correlation_results", results.assign(computed_at=pd.Timestamp.now().isoformat(timespec='seconds')))
+        print(f"Correlation results for {len(results)} column pairs saved to warehouse.db")
+    except sqlite3.Error as e:
+        print(f"Error saving correlation results to SQLite: {e}")
+
+
+# Lag analysis: pollution at t + lag is correlated with deforestation at t, so positive lags mean deforestation
+# leads; lags and rolling windows count periods of the resolution (months or days). Wide inputs are processed
+# in blocks of columns so per-station and per-tile series at daily resolution stay within memory
+lag_resolutions = {'month': 'MS', 'day': 'D'}
+lag_block_columns = 256
+tile_index_missing = ("The tile index is empty; run the 'load' command first "
+                      "(it is built from deforestation exports with alert locations).")
+
+
+# Pearson correlations from pairwise-complete sums (n, sums, sums of squares and cross products) of
+# every window or lag; NaN with fewer than min_periods pairs or when either side is constant
+def correlation_from_sums(n, sx, sy, sxx, syy, sxy, min_periods=3):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_x = sxx - sx ** 2 / n
+        var_y = syy - sy ** 2 / n
+        r = (sxy - sx * sy / n) / np.sqrt(var_x * var_y)
+    # Rounding can leave a constant window with a tiny variance instead of zero
+    flat = (var_x <= 1e-12 * sxx) | (var_y <= 1e-12 * syy)
+    return np.where((n >= min_periods) & ~flat, np.clip(r, -1, 1), np.nan)
+
+
+# 0/1 masks of the readings and the readings centred on their column mean with gaps as 0; centring keeps
+# the sums of squares small so the subtractions in correlation_from_sums do not lose precision
+def masked_columns(values):
+    valid = ~np.isnan(values)
+    means = np.where(valid, values, 0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    return valid.astype('float64'), np.where(valid, values - means, 0.0)
+
+
+# Cross-correlation of x and y (columns paired up, or one x column against every y column) at every lag,
+# over the pairs present at both t and t + lag. All six pairwise-complete sums come from FFT
+# cross-correlations of masks and values, so the cost does not grow with the number of lags
+# Returns (lags x columns) correlations and pair counts
+def lagged_correlations(x, y, lags, min_periods=3):
+    from scipy.fft import irfft, next_fast_len, rfft
     
-    # Get an average by averaging per month to align with deforestation dataset
-    df = df.groupby(df['Date'].dt.to_period('M')).mean(numeric_only=True).reset_index()
-    df['Date'] = df['Date'].dt.to_timestamp() # Convert period back to timestamp
+    x = np.asarray(x, dtype='float64').reshape(len(x), -1)
+    y = np.asarray(y, dtype='float64').reshape(len(y), -1)
+    lags = np.asarray(lags, dtype='int64')
+    # Zero padding past the longest lag keeps the circular correlation from wrapping around
+    size = next_fast_len(len(y) + int(np.abs(lags).max()), real=True)
+    columns = max(x.shape[1], y.shape[1])
+    r = np.empty((len(lags), columns))
+    n = np.empty((len(lags), columns), dtype='int64')
+    for start in range(0, columns, lag_block_columns):
+        block = slice(start, start + lag_block_columns)
+        x_mask, x_values = masked_columns(x[:, block] if x.shape[1] > 1 else x)
+        y_mask, y_values = masked_columns(y[:, block] if y.shape[1] > 1 else y)
+        x_spectra = rfft(np.stack([x_mask, x_values, x_values ** 2]), n=size, axis=1)
+        y_spectra = rfft(np.stack([y_mask, y_values, y_values ** 2]), n=size, axis=1)
+        
+        # Sum over t of the x-side term at t times the y-side term at t + lag, for every lag at once
+        def cross(i, j):
+            return irfft(np.conj(x_spectra[i]) * y_spectra[j], n=size, axis=0)[lags % size]
+        
+        counts = np.rint(cross(0, 0))
+        width = counts.shape[1]
+        r[:, start:start + width] = correlation_from_sums(counts, cross(1, 0), cross(0, 1), cross(2, 0), cross(0, 2),
+                                                          cross(1, 1), min_periods)
+        n[:, start:start + width] = counts
+    return r, n
+
+
+# Trailing rolling-window correlation of x and y ending at every row, like pandas' rolling(window).corr but
+# from differences of cumulative sums instead of a pass per window. Returns (rows x columns) correlations
+# and pair counts; the first rows use the shorter window available, as pandas does with min_periods
+def rolling_correlations(x, y, window, min_periods=None):
+    min_periods = window if min_periods is None else min_periods
+    x = np.asarray(x, dtype='float64').reshape(len(x), -1)
+    y = np.asarray(y, dtype='float64').reshape(len(y), -1)
+    rows, columns = len(y), max(x.shape[1], y.shape[1])
+    window_start = np.maximum(np.arange(1, rows + 1) - window, 0)
+    r = np.empty((rows, columns))
+    n = np.empty((rows, columns), dtype='int64')
+    for start in range(0, columns, lag_block_columns):
+        block = slice(start, start + lag_block_columns)
+        x_block, y_block = np.broadcast_arrays(x[:, block] if x.shape[1] > 1 else x,
+                                               y[:, block] if y.shape[1] > 1 else y)
+        # Only rows where both series have a reading count, as in pandas
+        both = ~(np.isnan(x_block) | np.isnan(y_block))
+        x_values = masked_columns(np.where(both, x_block, np.nan))[1]
+        y_values = masked_columns(np.where(both, y_block, np.nan))[1]
+        terms = np.stack([both, x_values, y_values, x_values ** 2, y_values ** 2, x_values * y_values])
+        running = np.zeros((6, rows + 1, terms.shape[2]))
+        np.cumsum(terms, axis=1, out=running[:, 1:])
+        sums = running[:, 1:] - running[:, window_start]
+        
+        counts = np.rint(sums[0])
+        width = counts.shape[1]
+        r[:, start:start + width] = correlation_from_sums(counts, sums[1], sums[2], sums[3], sums[4], sums[5],
+                                                          max(min_periods, 2))
+        n[:, start:start + width] = counts
+    return r, n
+
+
+# Raw pollution chunks with parsed timestamps, from the columnar store when available
+def pollution_chunks(columns):
+    csv_path = os.path.join(data_dir, 'cetesb.csv', 'cetesb.csv')
+    if columnar_available():
+        convert_to_columnar(csv_path, 'pollution')
+        yield from load_columnar('pollution', columns)
+        return
+    for chunk in pd.read_csv(csv_path, usecols=columns, chunksize=500000):
+        chunk['time'] = pd.to_datetime(chunk['time'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        yield chunk
+
+
+# Daily pollution means, city-wide (all stations' readings of a day, as in the monthly series) or per
+# station; returns a wide frame of Date rows and (Key, pollutant) columns, Key being the station or 0
+def daily_pollution(by_station=False):
+    if not os.path.exists(os.path.join(data_dir, 'cetesb.csv', 'cetesb.csv')):
+        print("cetesb.csv not found; run the 'fetch' command first.")
+        return None
+    pollutant_columns = [column for column, _ in warehouse_pollutants]
+    partials = []
+    for chunk in pollution_chunks(list(pollution_column_map) + (['id'] if by_station else [])):
+        chunk = chunk.rename(columns=pollution_column_map).dropna(subset=['Date'])
+        partials.append(daily_partials(chunk['Date'], [chunk[column] for column in pollutant_columns],
+                                       groups=chunk['id'] if by_station else None))
+    codes, sums, counts = merge_partials([partial for partial in partials if len(partial[0])])
+    keys, days = split_codes(codes) if by_station else (np.zeros(len(codes), dtype='int64'), codes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = pd.DataFrame(sums / np.where(counts > 0, counts, np.nan), columns=pollutant_columns)
+    means['Key'] = keys
+    means['Date'] = codes_to_timestamps(days, 'D')
+    return means.pivot(index='Date', columns='Key', values=pollutant_columns).swaplevel(axis=1).sort_index(axis=1)
+
+
+# Daily affected area of 'defor' alerts, in total (from the source) or per tile (from the alert table);
+# returns a wide frame of Date rows and one column per Key, the tile or 0, or None when there is no input
+def daily_deforestation(by_tile=False):
+    if by_tile:
+        conn = connect_warehouse()
+        try:
+            alerts = pd.read_sql('SELECT Date, Tile, AffectedArea FROM deforestation_alerts ORDER BY Tile, Date',
+                                 conn, parse_dates=['Date'])
+        finally:
+            conn.close()
+        if alerts.empty:
+            print(tile_index_missing)
+            return None
+        codes = combine_codes(alerts['Tile'], bucket_codes(alerts['Date'], 'D'))
+        order = np.argsort(codes, kind='stable')
+        codes, sums, _ = bucket_sums(codes[order], alerts['AffectedArea'].to_numpy()[order])
+        keys, days = split_codes(codes)
+    else:
+        csv_path = os.path.join(data_dir, 'deforestation.csv')
+        if not os.path.exists(csv_path):
+            print("deforestation.csv not found; run the 'fetch' command first.")
+            return None
+        if columnar_available():
+            import pyarrow.dataset as ds
+            convert_to_columnar(csv_path, 'deforestation')
+            frames = list(load_columnar('deforestation', ['date', 'ha_eck_iv'], where=ds.field('data_type') == 'defor'))
+            alerts = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['date', 'ha_eck_iv'])
+        else:
+            alerts = pd.read_csv(csv_path, usecols=['date', 'data_type', 'ha_eck_iv'])
+            alerts = alerts[alerts['data_type'] == 'defor']
+            alerts['date'] = pd.to_datetime(alerts['date'], format='%Y/%m/%d %H:%M:%S%z', errors='coerce').dt.tz_localize(None)
+        alerts = alerts.dropna(subset=['date', 'ha_eck_iv']).sort_values('date')
+        days, sums, _ = bucket_sums(bucket_codes(alerts['date'], 'D'), alerts['ha_eck_iv'])
+        keys = np.zeros(len(days), dtype='int64')
+    area = pd.DataFrame({'Date': codes_to_timestamps(days, 'D'), 'Key': keys, 'AffectedArea': sums[:, 0]})
+    return area.pivot(index='Date', columns='Key', values='AffectedArea')
+
+
+# Monthly counterparts of daily_pollution and daily_deforestation, from the warehouse tables; None (with a
+# hint at the command that fills them) when a table the scope needs is empty
+def monthly_lag_frames(by):
+    conn = connect_warehouse()
+    try:
+        if by == 'station':
+            pollution = pd.read_sql('SELECT * FROM pollution_by_station', conn, parse_dates=['Date'])
+            pollution = pollution.rename(columns={'Station': 'Key'})
+        else:
+            pollution = pd.read_sql('SELECT * FROM pollution', conn, parse_dates=['Date']).assign(Key=0)
+        if by == 'tile':
+            area = pd.read_sql('SELECT Date, Tile AS Key, AffectedArea FROM deforestation_tiles', conn, parse_dates=['Date'])
+        else:
+            area = pd.read_sql('SELECT Date, AffectedArea FROM deforestation', conn, parse_dates=['Date']).assign(Key=0)
+    finally:
+        conn.close()
+    if by == 'station' and pollution.empty:
+        print("pollution_by_station is empty; run 'load --grouped' first.")
+        return None
+    if by == 'tile' and area.empty:
+        print(tile_index_missing)
+        return None
+    if area.empty or pollution.empty:
+        print("The warehouse has no deforestation or pollution months; run the 'load' command first.")
+        return None
+    pollutant_columns = [column for column, _ in warehouse_pollutants]
+    pollution = pollution.pivot(index='Date', columns='Key', values=pollutant_columns).swaplevel(axis=1).sort_index(axis=1)
+    return area.pivot(index='Date', columns='Key', values='AffectedArea'), pollution
+
+
+# Aligned deforestation and pollution columns on one complete date index, paired up for the analysis:
+# by='tile' pairs every tile with every city-wide pollutant, by='station' the total area with every
+# station's pollutants, by='all' the total area with the city-wide pollutants
+# Returns the dates, the (rows x pairs) arrays and the Key and Pollutant of each pair, or None without input
+def lag_series(resolution='month', by='all'):
+    if resolution == 'day':
+        area = daily_deforestation(by_tile=by == 'tile')
+        pollution = daily_pollution(by_station=by == 'station') if area is not None else None
+        frames = (area, pollution) if pollution is not None else None
+    else:
+        frames = monthly_lag_frames(by)
+    if frames is None:
+        return None
+    area, pollution = frames
     
-    # Filter for the overlapping period
-    df = df[(df['Date'] >= '2013-05-01') & (df['Date'] <= '2018-12-31')]
+    # Both sides share one regular grid over the study window; days or tile months without alerts had no
+    # deforestation rather than a missing reading
+    area = area[(area.index >= study_start) & (area.index <= study_end)]
+    pollution = pollution[(pollution.index >= study_start) & (pollution.index <= study_end)]
+    if area.empty or pollution.empty:
+        print(f"No deforestation or pollution data between {study_start:%Y-%m-%d} and {study_end:%Y-%m-%d}.")
+        return None
+    dates = pd.date_range(min(area.index.min(), pollution.index.min()), max(area.index.max(), pollution.index.max()),
+                          freq=lag_resolutions[resolution])
+    area = area.reindex(dates)
+    if resolution == 'day' or by == 'tile':
+        area = area.fillna(0.0)
+    pollution = pollution.reindex(dates)
     
-    # Fill missing values in TRS, Benzene, and Toluene with 0
-    columns_to_fill = ['TRS', 'Benzene', 'Toluene']
-    df[columns_to_fill] = df[columns_to_fill].fillna(0)
+    if by == 'tile':
+        keys = np.repeat(area.columns.to_numpy(), pollution.shape[1])
+        pollutants = np.tile(pollution.columns.get_level_values(1).to_numpy(), area.shape[1])
+        x = np.repeat(area.to_numpy(dtype='float64'), pollution.shape[1], axis=1)
+        y = np.tile(pollution.to_numpy(dtype='float64'), area.shape[1])
+    else:
+        keys = pollution.columns.get_level_values(0).to_numpy()
+        pollutants = pollution.columns.get_level_values(1).to_numpy()
+        x = area.to_numpy(dtype='float64')
+        y = pollution.to_numpy(dtype='float64')
+    return dates, x, y, keys, pollutants
+
+
+# Lagged correlations over a lag range and, with a window, rolling correlations at rolling_lag, as long tables;
+# None when lag_series has no input
+@profiled()
+def lag_analysis(resolution='month', by='all', min_lag=0, max_lag=12, window=None, rolling_lag=0, min_periods=None):
+    series = lag_series(resolution, by)
+    if series is None:
+        return None
+    dates, x, y, keys, pollutants = series
+    lags = np.arange(min_lag, max_lag + 1)
+    r, n = lagged_correlations(x, y, lags)
+    labels = {'Resolution': resolution, 'Scope': by}
+    lag_results = pd.DataFrame({
+        **labels,
+        'Key': np.tile(keys, len(lags)),
+        'Pollutant': np.tile(pollutants, len(lags)),
+        'Lag': np.repeat(lags, len(keys)),
+        'n': n.ravel(),
+        'pearson': r.ravel()
+    })
+    if not window:
+        return lag_results, None
     
-    # Round values up to 2 decimal points
-    numeric_columns = ['PM10', 'TRS', 'O3', 'NO2', 'CO', 'PM2.5', 'SO2', 'Benzene', 'Toluene']
-    df[numeric_columns] = df[numeric_columns].round(2)
+    # Pollution rolling_lag periods later lines up with deforestation at each row
+    shifted = np.full_like(y, np.nan)
+    if rolling_lag >= 0:
+        shifted[:len(y) - rolling_lag] = y[rolling_lag:]
+    else:
+        shifted[-rolling_lag:] = y[:rolling_lag]
+    r, n = rolling_correlations(x, shifted, window, min_periods=min_periods)
+    rolling = pd.DataFrame({
+        **labels,
+        'Key': np.tile(keys, len(dates)),
+        'Pollutant': np.tile(pollutants, len(dates)),
+        'Lag': rolling_lag,
+        'Window': window,
+        'Date': np.repeat(dates, len(keys)),
+        'n': n.ravel(),
+        'pearson': r.ravel()
+    })
+    return lag_results, rolling[rolling['pearson'].notna()].reset_index(drop=True)
+
+
+# Replace the stored lag (and rolling) results of this resolution and scope, keeping the others
+def save_lag_analysis(lag_results, rolling=None):
+    resolution, scope = lag_results['Resolution'].iloc[0], lag_results['Scope'].iloc[0]
+    computed_at = pd.Timestamp.now().isoformat(timespec='seconds')
+    try:
+        conn = connect_warehouse()
+        try:
+            with conn:
+                for table, df in [('lag_correlations', lag_results), ('rolling_correlations', rolling)]:
+                    if df is None:
+                        continue
+                    conn.execute(f'DELETE FROM {table} WHERE Resolution = ? AND Scope = ?', (resolution, scope))
+                    insert_rows(conn, table, df.assign(computed_at=computed_at))
+        finally:
+            conn.close()
+        print(f"Lag correlations ({len(lag_results)} rows) saved to warehouse.db"
+              + (f", rolling correlations ({len(rolling)} rows)" if rolling is not None else ""))
+    except sqlite3.Error as e:
+        print(f"Error saving lag correlations to SQLite: {e}")
+
+
+# Import pyplot, with the backend picked from the display on first use, and seaborn
+def plotting_modules(backend=None):
+    import matplotlib
+    if 'matplotlib.pyplot' not in sys.modules:
+        matplotlib.use(backend or ('Agg' if headless else 'Qt5Agg'))
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    return plt, sns
+
+
+# Show the finished figure in interactive mode, then always release it so figure memory does not pile up
+def finish_figure():
+    plt, _ = plotting_modules()
+    if not batch_plots:
+        plt.show()
+    plt.close('all')
 
-    return df
 
 # Deforestation Trend Plot
+@profiled()
 def plot_deforestation_trend(deforestation_df):
     
+    plt, sns = plotting_modules()
+    
     # Get data directory dynamically
-    save_dir = os.path.abspath(os.path.join(script_dir, '..', 'data'))
+    save_dir = data_dir
     
     # Create the directory if it doesn't exist
     os.makedirs(save_dir, exist_ok=True)
@@ -255,12 +2656,15 @@ def plot_deforestation_trend(deforestation_df):
     plt.tight_layout()
     plt.savefig(plot_filename)
     
-    plt.show()
+    finish_figure()
     
 # Function to plot deforestation trend with each pollutant using a secondary y-axis
+@profiled()
 def plot_deforestation_with_pollutants(deforestation_df, pollution_df):
+    plt, _ = plotting_modules()
+    
     # Get the directory to save plots dynamically
-    save_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
+    save_dir = data_dir
     
     # Ensure the directory exists
     os.makedirs(save_dir, exist_ok=True)
@@ -294,13 +2698,16 @@ def plot_deforestation_with_pollutants(deforestation_df, pollution_df):
         plt.savefig(plot_filename)
         
         # Show the plot
-        plt.show()
+        finish_figure()
     
 # Trend Plot for all pollutants
+@profiled()
 def plot_pollutant_trends(pollution_df):
     
+    plt, sns = plotting_modules()
+    
     # Get data directory dynamically
-    save_dir = os.path.abspath(os.path.join(script_dir, '..', 'data'))
+    save_dir = data_dir
     
     # Create the directory if it doesn't exist
     os.makedirs(save_dir, exist_ok=True)
@@ -324,12 +2731,16 @@ def plot_pollutant_trends(pollution_df):
         plt.savefig(plot_filename)
         
         # Show the plot
-        plt.show()
+        finish_figure()
     
 # Correlation Heatmap
+@profiled()
 def plot_correlation_heatmap(deforestation_df, pollution_df):
+    from scipy.stats import shapiro, probplot
+    plt, sns = plotting_modules()
+    
     # Get data directory dynamically
-    save_dir = os.path.abspath(os.path.join(script_dir, '..', 'data'))
+    save_dir = data_dir
     
     # Create the directory if it doesn't exist
     os.makedirs(save_dir, exist_ok=True)
@@ -356,7 +2767,7 @@ def plot_correlation_heatmap(deforestation_df, pollution_df):
         plt.tight_layout()
         plt.legend()
         plt.savefig(plot_filename)
-        plt.show()
+        finish_figure()
 
     # Check linearity with a scatter plot and linear regression for each pollutant
     for pollutant in correlation_columns[1:]:
@@ -368,15 +2779,7 @@ def plot_correlation_heatmap(deforestation_df, pollution_df):
         plot_filename = os.path.join(save_dir, f'Scatter Plot Affected Area vs {pollutant}.png')
         plt.tight_layout()
         plt.savefig(plot_filename)
-        plt.show()
-
-        # Linear regression analysis
-        X = merged_df['AffectedArea']
-        y = merged_df[pollutant]
-        X = sm.add_constant(X)  # Add constant to model for intercept
-        model = sm.OLS(y, X).fit()
-        print(f"Linear regression summary for {pollutant}:")
-        print(model.summary())
+        finish_figure()
 
         # Residual Plot
         plt.figure(figsize=(8, 6))
@@ -385,22 +2788,16 @@ def plot_correlation_heatmap(deforestation_df, pollution_df):
         plt.tight_layout()
         plot_filename = os.path.join(save_dir, f'Residual Plot Affected Area vs {pollutant}.png')
         plt.savefig(plot_filename)
-        plt.show()
-
-        # Spearman's Rank Correlation (for non-normal or non-linear relationships)
-        spearman_stat, spearman_p = spearmanr(merged_df['AffectedArea'], merged_df[pollutant])
-        print(f"Spearman's Rank Correlation for {pollutant}: Statistics={spearman_stat:.3f}, p={spearman_p:.3f}")
-        
-        # Kendall's Tau (alternative non-parametric correlation)
-        kendall_stat, kendall_p = kendalltau(merged_df['AffectedArea'], merged_df[pollutant])
-        print(f"Kendall's Tau for {pollutant}: Statistics={kendall_stat:.3f}, p={kendall_p:.3f}")
+        finish_figure()
 
-    # Calculate and plot correlation matrix (only Spearman between AffectedArea and pollutants)
-    spearman_corr = merged_df.corr(method="spearman")  # Calculate Spearman correlation
+    # Spearman correlations for the heatmap; correlation_results is written only by analyze and full runs, so
+    # plotting never replaces stored results (or drops their bootstrap intervals)
+    results = correlation_results(deforestation_df, pollution_df)
 
-    # Create a heatmap to visualize the correlation between AffectedArea and each pollutant
-    spearman_corr = spearman_corr.loc[["AffectedArea"], :]  # Only keep the row for AffectedArea
-    spearman_corr = spearman_corr.T # Transpose to show correlations as a column
+    # Create a heatmap to visualize the Spearman correlation between AffectedArea and each pollutant
+    spearman_corr = results[results['x'] == "AffectedArea"].set_index('y')[['spearman']]
+    spearman_corr = pd.concat([pd.DataFrame({'spearman': [1.0]}, index=["AffectedArea"]), spearman_corr])
+    spearman_corr.columns = ["AffectedArea"]
 
     plt.figure(figsize=(8, 6))
     sns.heatmap(spearman_corr, annot=True, fmt=".2f", cmap="coolwarm", cbar=True, vmin=-1, vmax=1)
@@ -410,11 +2807,14 @@ def plot_correlation_heatmap(deforestation_df, pollution_df):
     plot_filename = os.path.join(save_dir, "Spearman Correlation Affected Area vs Pollutants.png")
     plt.tight_layout()
     plt.savefig(plot_filename)
-    plt.show()
+    finish_figure()
     
 # Scatter plot for deforestation vs each pollutant
+@profiled()
 def plot_deforestation_vs_pollutant(deforestation_df, pollution_df, pollutants):
     
+    plt, sns = plotting_modules()
+    
     # Merge datasets
     merged_df = pd.merge(deforestation_df, pollution_df, on="Date", how="inner")
     
@@ -424,67 +2824,547 @@ def plot_deforestation_vs_pollutant(deforestation_df, pollution_df, pollutants):
         plt.title(f"Deforestation Area vs {pollutant}")
         plt.xlabel(f"{pollutant} Levels")
         plt.ylabel("Deforestation Area (ha)")
-        plt.show()
+        plt.tight_layout()
+        plt.savefig(os.path.join(data_dir, f"deforestation_area_vs_{pollutant}.png"))
+        finish_figure()
+
+
+# Plot jobs as (name, function, arguments, output files): one job per figure where the plot functions
+# loop over pollutants, so they spread across the pool; the outputs are what must exist to skip a job
+def plot_jobs(deforestation_df, pollution_df):
+    pollutants = list(pollution_df.columns.difference(['Date']))
+    jobs = [('deforestation_trend', plot_deforestation_trend, (deforestation_df,), ['deforestation_trend.png'])]
+    for pollutant in pollutants:
+        single = pollution_df[['Date', pollutant]]
+        jobs += [
+            (f'deforestation_with_{pollutant}', plot_deforestation_with_pollutants, (deforestation_df, single),
+             [f'deforestation_vs_{pollutant}.png']),
+            (f'trend_{pollutant}', plot_pollutant_trends, (single,), [f'{pollutant}.png']),
+            (f'deforestation_vs_{pollutant}', plot_deforestation_vs_pollutant, (deforestation_df, single, [pollutant]),
+             [f'deforestation_area_vs_{pollutant}.png'])
+        ]
+    jobs.append(('correlation_heatmap', plot_correlation_heatmap, (deforestation_df, pollution_df),
+                 ['Spearman Correlation Affected Area vs Pollutants.png']))
+    return jobs
+
+
+# Hash of a plot job's inputs; a job whose hash matches the manifest and whose outputs exist is skipped
+def plot_input_hash(name, args):
+    digest = hashlib.sha256(name.encode())
+    for arg in args:
+        if isinstance(arg, pd.DataFrame):
+            digest.update(','.join(map(str, arg.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(arg, index=False).values.tobytes())
+        else:
+            digest.update(repr(arg).encode())
+    return digest.hexdigest()
 
 
-# Clear existing datasets, then download fresh ones
-clear_existing_datasets()
-deforestation_path = os.path.join(data_dir, "deforestation.csv")
-pollution_data_path = os.path.join(data_dir, "cetesb.csv", "cetesb.csv")
+# Render one plot job in a worker process with the Agg backend
+def render_plot_job(func, args):
+    global batch_plots
+    batch_plots = True
+    plt, _ = plotting_modules('Agg')
+    plt.switch_backend('Agg')
+    try:
+        func(*args)
+    finally:
+        plt.close('all')
 
-# Check if mock data should be used
-if os.getenv('USE_MOCK_DATA') == 'true':
-    create_mock_data()
-else:
-    # Download datasets
-    download_data(deforestation_url, deforestation_path)
-    pollution_data_path = download_pollution_data()
 
-# Run data loading and save to SQLite if downloads succeed
-if os.path.exists(deforestation_path) and pollution_data_path:
-    # Load datasets
-    deforestation_df = pd.read_csv(deforestation_path)
-    pollution_df = pd.read_csv(pollution_data_path)
+# Batch mode: render every figure headlessly across a process pool, skipping figures whose inputs are unchanged
+def render_plots(deforestation_df, pollution_df, workers=None, force=False):
+    manifest_path = os.path.join(data_dir, 'plot_manifest.json')
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
     
-    # Apply transformations
-    deforestation_df = clean_deforestation_data(deforestation_df)
-    pollution_df = clean_pollution_data(pollution_df)
+    pending = {}
+    skipped = 0
+    for name, func, args, outputs in plot_jobs(deforestation_df, pollution_df):
+        input_hash = plot_input_hash(name, args)
+        outputs_exist = all(os.path.exists(os.path.join(data_dir, output)) for output in outputs)
+        if not force and manifest.get(name) == input_hash and outputs_exist:
+            skipped += 1
+            continue
+        pending[name] = (func, args, input_hash)
     
-    # Plot Deforestation trend based on each pollutant
-    # plot_deforestation_with_pollutants(deforestation_df, pollution_df)
+    failed = []
+    if pending:
+        with process_pool(workers) as pool:
+            futures = {pool.submit(render_plot_job, func, args): name for name, (func, args, _) in pending.items()}
+            for future in futures:
+                name = futures[future]
+                try:
+                    future.result()
+                    manifest[name] = pending[name][2]
+                except Exception as e:
+                    # A failed figure is reported and retried next run; the others still render
+                    manifest.pop(name, None)
+                    failed.append(name)
+                    print(f"Plot '{name}' failed: {e}")
     
-    # Plot Deforestation trend solely
-    # plot_deforestation_trend(deforestation_df)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(f"Plots: {len(pending) - len(failed)} rendered, {skipped} unchanged, {len(failed)} failed")
+    return failed
+
+
+# Run a stage function and measure its wall time
+# Functions submitted to process pools, such as this one, render_plot_job and bootstrap_correlations, stay
+# module-level so the pools can pickle them
+def timed_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+# Process pool whose workers come from a fork server (spawned where there is none) instead of forking this
+# process: its io threads may hold run_log_lock, cache_lock or tracemalloc_lock, and a forked child would
+# inherit them held forever. The server imports this module once, so workers start without re-importing it
+def process_pool(max_workers):
+    import multiprocessing
     
-    # Plot Pollutants Over Time
-    # plot_pollutant_trends(pollution_df)
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+# Minimal stage scheduler: stages are {name: (pool, func, dependencies)} where pool is 'io' (threads)
+# or 'cpu' (processes); each stage starts as soon as its dependencies finished and receives their results
+def run_stages(stages, io_workers=4, cpu_workers=2):
+    results = {}
+    timings = {}
+    pending = dict(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=io_workers) as io_pool, process_pool(cpu_workers) as cpu_pool:
+        pools = {'io': io_pool, 'cpu': cpu_pool}
+        while pending or running:
+            for name, (pool, func, dependencies) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    args = [results[dependency] for dependency in dependencies]
+                    running[pools[pool].submit(timed_call, func, *args)] = name
+                    del pending[name]
+            if not running:
+                raise RuntimeError(f"Stages with unmet dependencies: {', '.join(pending)}")
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], timings[name] = future.result()
+                print(f"Stage '{name}' finished in {timings[name]:.2f}s")
+    return results, timings
+
+
+# Stage: fetch the deforestation source, returns its local path and HTTP validators
+def fetch_deforestation_stage(offline=False, use_mock=False):
+    deforestation_path = os.path.join(data_dir, "deforestation.csv")
+    etag = last_modified = None
+    sources = load_deforestation_sources()
+    if not use_mock and sources:
+        _, etag, last_modified = download_arcgis_sources(sources, deforestation_path, offline=offline)
+    elif not use_mock:
+        _, etag, last_modified = download_data(deforestation_url, deforestation_path, offline=offline)
+    if not os.path.exists(deforestation_path):
+        raise FileNotFoundError(f"'deforestation.csv' not found in {data_dir}")
+    return {'path': deforestation_path, 'etag': etag, 'last_modified': last_modified}
+
+
+# Stage: fetch the pollution source, returns its local path
+def fetch_pollution_stage(offline=False, use_mock=False):
+    pollution_data_path = os.path.join(data_dir, "cetesb.csv", "cetesb.csv")
+    if not use_mock:
+        pollution_data_path = download_pollution_data(offline=offline)
+    if not pollution_data_path or not os.path.exists(pollution_data_path):
+        raise FileNotFoundError(f"'cetesb.csv' not found in {data_dir}")
+    return pollution_data_path
+
+
+# Stage: read a raw source once through its quality checks into the columnar store; a DataQualityError here
+# stops the run before either source is aggregated or saved. Without pyarrow the cleaning stages check the
+# chunks as they parse them, and the save stages wait for both, so the file is not parsed twice
+@profiled()
+def check_source_stage(source, csv_path):
+    if columnar_available():
+        convert_to_columnar(csv_path, source)
+    return csv_path
+
+
+def check_deforestation_stage(fetched):
+    return check_source_stage('deforestation', fetched['path'])
+
+
+def check_pollution_stage(pollution_data_path):
+    return check_source_stage('pollution', pollution_data_path)
+
+
+# Stage: load and clean the deforestation source once both sources passed their checks
+def clean_deforestation_stage(fetched, *checked, by_source=False):
+    return clean_deforestation_source(fetched['path'], by_source=by_source)
+
+
+# Stage: load and clean the pollution source once both sources passed their checks
+def clean_pollution_stage(pollution_data_path, *checked, by_station=False):
+    return clean_pollution_source(pollution_data_path, by_station=by_station)
+
+
+# Stage: save the deforestation table along with its high-water mark, once both sources are cleaned
+def save_deforestation_stage(deforestation_df, fetched, *cleaned):
+    try:
+        watermark = {'source': 'deforestation', 'last_date': deforestation_df['Date'].max(), 'etag': fetched['etag'],
+                     'checksum': file_checksum(fetched['path']), 'last_modified': fetched['last_modified']}
+        replace_table("deforestation", deforestation_df, watermark)
+        print("Deforestation data saved to warehouse.db")
+    except sqlite3.Error as e:
+        print(f"Error saving deforestation data to SQLite: {e}")
+
+
+# Stage: save the pollution table along with its high-water mark, once both sources are cleaned
+def save_pollution_stage(pollution_df, pollution_data_path, *cleaned):
+    try:
+        watermark = {'source': 'pollution', 'last_date': pollution_df['Date'].max(),
+                     'checksum': file_checksum(pollution_data_path)}
+        replace_table("pollution", pollution_df, watermark)
+        print("Pollution data saved to warehouse.db")
+    except sqlite3.Error as e:
+        print(f"Error saving pollution data to SQLite: {e}")
+
+
+# Save a long-format grouped table; its (group, Date) primary key serves per-group queries
+def save_grouped_table(table, df):
+    try:
+        count = replace_table(table, df)
+        print(f"{table} saved to warehouse.db ({count} rows)")
+    except sqlite3.Error as e:
+        print(f"Error saving {table} to SQLite: {e}")
+
+
+# Stage: save the city-wide deforestation table and the per-source table from the same cleaning result
+def save_deforestation_grouped_stage(cleaned, fetched, *other):
+    deforestation_df, by_source_df = cleaned
+    save_deforestation_stage(deforestation_df, fetched)
+    save_grouped_table('deforestation_by_source', by_source_df)
+
+
+# Stage: save the city-wide pollution table and the per-station table from the same cleaning result
+def save_pollution_grouped_stage(cleaned, pollution_data_path, *other):
+    pollution_df, by_station_df = cleaned
+    save_pollution_stage(pollution_df, pollution_data_path)
+    save_grouped_table('pollution_by_station', by_station_df)
+
+
+# Pipeline stages in order; each command runs the stages up to its own
+etl_steps = ['fetch', 'check', 'clean', 'save']
+
+# Heavy modules each command needs beyond pandas and sqlite3 (pyarrow is optional)
+command_modules = {
+    'fetch': ['requests', 'aiohttp'],
+    'clean': ['requests', 'aiohttp', 'pyarrow.dataset'],
+    'load': ['requests', 'aiohttp', 'pyarrow.dataset'],
+    'analyze': ['scipy.stats'],
+    'plot': ['scipy.stats', 'matplotlib.pyplot', 'seaborn'],
+    'area': [],
+    'range': [],
+    'lags': ['scipy.fft', 'pyarrow.dataset']
+}
+
+
+# Import the modules a command needs and return how long that took
+def import_command_modules(*commands):
+    start = time.perf_counter()
+    for command in commands:
+        for module in command_modules[command]:
+            try:
+                if module == 'matplotlib.pyplot':
+                    plotting_modules()
+                else:
+                    import_module(module)
+            except ImportError:
+                pass
+    return time.perf_counter() - start
+
+
+# Run the ETL stages up to `until` ('fetch', 'clean' or 'save') for both sources
+# Downloads and writes run on a thread pool, cleaning runs in separate processes
+# With grouped=True the per-station and per-source tables are built in the same cleaning pass
+def run_etl(until='save', offline=False, grouped=False):
+    use_mock = os.getenv('USE_MOCK_DATA') == 'true'
     
-    # Plot Correlation Heatmap
-    # plot_correlation_heatmap(deforestation_df, pollution_df)
+    # Check if mock data should be used
+    if use_mock:
+        create_mock_data(**mock_scales[mock_scale])
     
-    #pollutants = pollution_df.columns.difference(['Date'])
-    #plot_deforestation_vs_pollutant(deforestation_df, pollution_df, pollutants)
+    stages = {
+        'fetch_deforestation': ('io', partial(fetch_deforestation_stage, offline, use_mock), []),
+        'fetch_pollution': ('io', partial(fetch_pollution_stage, offline, use_mock), []),
+        'check_deforestation': ('cpu', check_deforestation_stage, ['fetch_deforestation']),
+        'check_pollution': ('cpu', check_pollution_stage, ['fetch_pollution']),
+        'clean_deforestation': ('cpu', partial(clean_deforestation_stage, by_source=grouped),
+                                ['fetch_deforestation', 'check_deforestation', 'check_pollution']),
+        'clean_pollution': ('cpu', partial(clean_pollution_stage, by_station=grouped),
+                            ['fetch_pollution', 'check_deforestation', 'check_pollution']),
+        'save_deforestation': ('io', save_deforestation_grouped_stage if grouped else save_deforestation_stage,
+                               ['clean_deforestation', 'fetch_deforestation', 'clean_pollution']),
+        'save_pollution': ('io', save_pollution_grouped_stage if grouped else save_pollution_stage,
+                           ['clean_pollution', 'fetch_pollution', 'clean_deforestation']),
+        'clean_tiles': ('cpu', clean_tiles_stage, ['fetch_deforestation', 'clean_deforestation', 'clean_pollution']),
+        'save_tiles': ('io', save_tiles_stage, ['clean_tiles'])
+    }
+    steps = etl_steps[:etl_steps.index(until) + 1]
+    stages = {name: stage for name, stage in stages.items() if name.split('_')[0] in steps}
+    try:
+        results, timings = run_stages(stages)
+    except FileNotFoundError as e:
+        print(f"Data download failed ({e}). Please check paths and Kaggle credentials.")
+        return None
+    except DataQualityError as e:
+        print(f"Stopped before aggregating and saving: {e}")
+        return None
     
-    # Save to deforestation.db
-    deforestation_db_path = os.path.join(data_dir, "deforestation.db")
+    print("Stage timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+    return results
+
+
+# Cleaned monthly frames as returned by the cleaning stages, without their grouped tables
+def cleaned_frames(results, grouped=False):
+    deforestation_df = results['clean_deforestation']
+    pollution_df = results['clean_pollution']
+    if grouped:
+        deforestation_df, pollution_df = deforestation_df[0], pollution_df[0]
+    return deforestation_df, pollution_df
+
+
+# Monthly deforestation and pollution frames from the warehouse, or None before the first load
+def read_warehouse_frames():
+    if not os.path.exists(warehouse_db_path):
+        print("warehouse.db not found; run the 'load' command first.")
+        return None
+    conn = connect_warehouse()
     try:
-        conn = sqlite3.connect(deforestation_db_path)
-        deforestation_df.to_sql("deforestation", conn, if_exists="replace", index=False)
+        deforestation_df = pd.read_sql('SELECT * FROM deforestation ORDER BY Date', conn, parse_dates=['Date'])
+        pollution_df = pd.read_sql('SELECT * FROM pollution ORDER BY Date', conn, parse_dates=['Date'])
+    finally:
         conn.close()
-        print("Deforestation data saved to deforestation.db")
-    except sqlite3.Error as e:
-        print(f"Error saving deforestation data to SQLite: {e}")
+    if deforestation_df.empty or pollution_df.empty:
+        print("The warehouse has no deforestation or pollution months; run the 'load' command first.")
+        return None
+    return deforestation_df, pollution_df
+
+
+# Full run: fetch both sources (through the cache), rebuild the warehouse tables and store the statistics
+# bootstrap > 0 adds percentile confidence intervals from that many resamples, computed on a process pool
+# plots=True renders every figure in batch mode after the databases are written
+def run_full(offline=False, grouped=False, bootstrap=0, plots=False):
+    results = run_etl('save', offline=offline, grouped=grouped)
+    if results is None:
+        return
+    deforestation_df, pollution_df = cleaned_frames(results, grouped)
+    
+    # Correlation and regression statistics between deforestation and every pollutant
+    save_correlation_results(correlation_results(deforestation_df, pollution_df, bootstrap=bootstrap))
+    
+    # Render the trend, comparison, scatter and correlation figures headlessly in a process pool
+    if plots:
+        render_plots(deforestation_df, pollution_df)
     
-    # Save to air_pollution.db
-    pollution_db_path = os.path.join(data_dir, "air_pollution.db")
+    print("Data pipeline complete. Datasets saved to the SQLite warehouse.")
+
+
+# fetch: download both sources into the local cache
+def fetch_command(args):
+    results = run_etl('fetch', offline=args.offline)
+    if results is not None:
+        print(f"Deforestation source: {results['fetch_deforestation']['path']}")
+        print(f"Pollution source: {results['fetch_pollution']}")
+
+
+# clean: fetch and aggregate both sources without touching the warehouse
+def clean_command(args):
+    results = run_etl('clean', offline=args.offline, grouped=args.grouped)
+    if results is not None:
+        deforestation_df, pollution_df = cleaned_frames(results, args.grouped)
+        print(f"Deforestation: {len(deforestation_df)} months from {deforestation_df['Date'].min():%Y-%m} to {deforestation_df['Date'].max():%Y-%m}")
+        print(f"Pollution: {len(pollution_df)} months from {pollution_df['Date'].min():%Y-%m} to {pollution_df['Date'].max():%Y-%m}")
+
+
+# load: fetch, clean and write the warehouse tables (incrementally with --incremental)
+def load_command(args):
+    if args.incremental:
+        if args.grouped:
+            print("--grouped is ignored in incremental runs; run a full rebuild to refresh the grouped tables")
+        try:
+            run_incremental(offline=args.offline)
+        except DataQualityError as e:
+            print(f"Stopped the incremental run: {e}")
+    elif run_etl('save', offline=args.offline, grouped=args.grouped) is not None:
+        print("Warehouse load complete.")
+
+
+# analyze: recompute correlation_results from the monthly tables in the warehouse
+def analyze_command(args):
+    frames = read_warehouse_frames()
+    if frames is not None:
+        save_correlation_results(correlation_results(*frames, bootstrap=args.bootstrap))
+
+
+# plot: render every figure from the monthly tables in the warehouse
+def plot_command(args):
+    frames = read_warehouse_frames()
+    if frames is not None:
+        render_plots(*frames, force=args.force)
+
+
+# area: monthly affected area inside a bounding box or named region, from the tile index
+def area_command(args):
+    bbox = args.region or tuple(args.bbox)
+    start = pd.Timestamp(args.start) if args.start else None
+    end = pd.Timestamp(args.end) if args.end else None
     try:
-        conn = sqlite3.connect(pollution_db_path)
-        pollution_df.to_sql("pollution", conn, if_exists="replace", index=False)
-        conn.close()
-        print("Pollution data saved to air_pollution.db")
-    except sqlite3.Error as e:
-        print(f"Error saving pollution data to SQLite: {e}")
+        df = bbox_monthly_area(bbox, start=start, end=end)
+    except ValueError as e:
+        print(e)
+        return
+    print(df.to_string(index=False))
+    print(f"Total: {df['AffectedArea'].sum():.2f} ha in {df['Alerts'].sum()} alerts")
+
+
+# range: sum and mean of a measure over a date range, from the rollup prefix sums
+def range_command(args):
+    try:
+        result = rollup_range(args.measure, args.start, args.end, level=args.level)
+    except ValueError as e:
+        print(e)
+        return
+    print(f"{result['measure']} from {result['start']:%Y-%m-%d} to {result['end']:%Y-%m-%d} ({result['level']}s): "
+          f"sum {result['sum']}, monthly mean {result['mean']} over {result['count']} months with data")
+
+
+# lags: cross-correlation of deforestation and each pollutant over a lag range, optionally rolling correlations
+def lags_command(args):
+    if not os.path.exists(warehouse_db_path):
+        print("warehouse.db not found; run the 'load' command first.")
+        return
+    if args.min_lag > args.max_lag:
+        print("--min-lag must not be larger than --max-lag")
+        return
+    results = lag_analysis(args.resolution, args.by, min_lag=args.min_lag, max_lag=args.max_lag,
+                           window=args.window, rolling_lag=args.rolling_lag, min_periods=args.min_periods)
+    if results is None:
+        return
+    lag_results, rolling = results
+    save_lag_analysis(lag_results, rolling)
+    
+    # Strongest lag of each pollutant, by absolute correlation averaged over stations or tiles
+    strongest = lag_results.groupby(['Pollutant', 'Lag'])['pearson'].mean().dropna().reset_index()
+    strongest = strongest.loc[strongest['pearson'].abs().groupby(strongest['Pollutant']).idxmax()]
+    print(f"Strongest lag of each pollutant ({args.resolution}s, scope '{args.by}'):")
+    print(strongest.rename(columns={'pearson': 'mean pearson'}).to_string(index=False))
+
+
+# Without a command the whole pipeline runs, as it always has
+def default_command(args):
+    if args.incremental:
+        load_command(args)
+    else:
+        run_full(offline=args.offline, grouped=args.grouped, bootstrap=args.bootstrap, plots=args.plots)
+
+
+def main():
+    # Options shared by the top-level run and the subcommands
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--offline', action='store_true',
+                        help="run entirely from the local source cache without touching the network")
+    common.add_argument('--import-time', action='store_true',
+                        help="report how long importing the command's dependencies took")
+    common.add_argument('--profile', choices=['cprofile', 'tracemalloc'],
+                        help="dump a cProfile or tracemalloc profile of every stage under data/profiles/<run id>/")
+    grouped = argparse.ArgumentParser(add_help=False)
+    grouped.add_argument('--grouped', action='store_true',
+                         help="also build per-station pollution and per-source deforestation tables (full runs only)")
+    incremental = argparse.ArgumentParser(add_help=False)
+    incremental.add_argument('--incremental', action='store_true',
+                             help="only recompute and upsert months from the stored high-water mark onward")
+    bootstrap = argparse.ArgumentParser(add_help=False)
+    bootstrap.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                           help="add bootstrap confidence intervals from N resamples to correlation_results")
+    
+    parser = argparse.ArgumentParser(description="Deforestation and air pollution data pipeline",
+                                     parents=[common, grouped, incremental, bootstrap])
+    parser.add_argument('--plots', action='store_true',
+                        help="render all figures headlessly to PNG files, skipping those whose inputs are unchanged")
+    parser.set_defaults(func=default_command, modules=['load', 'analyze'])
+    
+    commands = parser.add_subparsers(title='commands', metavar='{fetch,clean,load,analyze,plot,area,range,lags}')
+    command = commands.add_parser('fetch', parents=[common], help="download both sources into the local cache")
+    command.set_defaults(func=fetch_command, modules=['fetch'])
+    command = commands.add_parser('clean', parents=[common, grouped], help="fetch and aggregate without writing")
+    command.set_defaults(func=clean_command, modules=['clean'])
+    command = commands.add_parser('load', parents=[common, grouped, incremental], help="fetch, clean and write the warehouse")
+    command.set_defaults(func=load_command, modules=['load'])
+    command = commands.add_parser('analyze', parents=[common, bootstrap], help="recompute correlation_results from the warehouse")
+    command.set_defaults(func=analyze_command, modules=['analyze'])
+    command = commands.add_parser('plot', parents=[common], help="render all figures from the warehouse")
+    command.add_argument('--force', action='store_true', help="re-render figures even if their inputs are unchanged")
+    command.set_defaults(func=plot_command, modules=['plot'])
+    command = commands.add_parser('area', parents=[common], help="monthly affected area in a bounding box from the tile index")
+    region = command.add_mutually_exclusive_group(required=True)
+    region.add_argument('--bbox', nargs=4, type=float, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'),
+                        help="bounding box in degrees")
+    region.add_argument('--region', choices=list(study_regions), help="named study region")
+    command.add_argument('--start', help="first month (YYYY-MM-DD)")
+    command.add_argument('--end', help="last month (YYYY-MM-DD)")
+    command.set_defaults(func=area_command, modules=['area'])
+    range_parser = commands.add_parser('range', parents=[common], help="sum and mean of a measure over a date range from the rollups")
+    range_parser.add_argument('measure', help="AffectedArea or a pollutant column")
+    range_parser.add_argument('--start', type=pd.Timestamp, required=True, help="first month (YYYY-MM or YYYY-MM-DD)")
+    range_parser.add_argument('--end', type=pd.Timestamp, required=True, help="last month (YYYY-MM or YYYY-MM-DD)")
+    range_parser.add_argument('--level', choices=list(rollup_levels), default='month')
+    range_parser.set_defaults(func=range_command, modules=['range'])
+    command = commands.add_parser('lags', parents=[common], help="lagged and rolling correlations of deforestation and pollution")
+    command.add_argument('--resolution', choices=list(lag_resolutions), default='month',
+                         help="monthly series from the warehouse or daily series from the sources")
+    command.add_argument('--by', choices=['all', 'station', 'tile'], default='all',
+                         help="correlate per pollution station or per deforestation tile")
+    command.add_argument('--min-lag', type=int, default=0, help="smallest lag in periods (negative: pollution leads)")
+    command.add_argument('--max-lag', type=int, default=12, help="largest lag in periods")
+    command.add_argument('--window', type=int, help="also store rolling correlations over windows of this many periods")
+    command.add_argument('--rolling-lag', type=int, default=0, help="lag of the rolling correlations")
+    command.add_argument('--min-periods', type=int, help="fewest pairs in a rolling window (default: the window)")
+    command.set_defaults(func=lags_command, modules=['lags'])
+    args = parser.parse_args()
+    if args.func is range_command and args.start.to_period(rollup_levels[args.level]) > args.end.to_period(
+            rollup_levels[args.level]):
+        range_parser.error("--start must not be later than --end")
     
-    print("Data pipeline complete. Datasets saved to SQLite databases.")
-else:
-    print("Data download failed. Please check paths and Kaggle credentials.")
+    # Heavy modules are imported here, only for the command being run
+    modules = args.modules + (['plot'] if getattr(args, 'plots', False) else [])
+    seconds = import_command_modules(*modules)
+    if args.import_time:
+        print(f"Imported {', '.join(sorted({module for name in modules for module in command_modules[name]}))} in {seconds:.3f}s")
+    
+    # Stage records of this run (including those written by worker processes) share its run id
+    run_id = pd.Timestamp.now().strftime('%Y%m%dT%H%M%S') + f"-{os.getpid()}"
+    os.environ['PIPELINE_RUN_ID'] = run_id
+    if args.profile:
+        os.environ['PIPELINE_PROFILE'] = args.profile
+    try:
+        args.func(args)
+    finally:
+        report = record_quality_report(run_id)
+        if report is not None:
+            flagged = report[report['status'] != 'ok']
+            print(f"Data quality: {len(report)} checks saved to data_quality, {len(flagged)} with violations")
+            for row in flagged.itertuples():
+                print(f"  [{row.status}] {row.source} {row.rule} {row.field}: {row.violations} of {row.rows} rows"
+                      + (f" (first at {row.example})" if row.example else ""))
+        count = record_run(run_id)
+        if count:
+            print(f"Run {run_id}: {count} stage records saved to pipeline_runs and {os.path.basename(run_log_path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,7 @@ cd "$(dirname "$0")"
 # Set relative paths
 PIPELINE="./pipeline.sh"
 DATA_DIR="../data"
-DEFORESTATION_DB="$DATA_DIR/deforestation.db"
-AIR_POLLUTION_DB="$DATA_DIR/air_pollution.db"
+WAREHOUSE_DB="$DATA_DIR/warehouse.db"
 
 # Determine mode: mock or real
 if [ "$USE_MOCK_DATA" = "true" ]; then
@@ -19,34 +18,68 @@ fi
 # Run the pipeline with the appropriate mode
 bash "$PIPELINE"
 
-# Check if deforestation.db exists
-if [ -f "$DEFORESTATION_DB" ]; then
-    echo "✅ $DEFORESTATION_DB exists."
+# Check if warehouse.db exists
+if [ -f "$WAREHOUSE_DB" ]; then
+    echo "✅ $WAREHOUSE_DB exists."
 else
-    echo "❌ $DEFORESTATION_DB is missing."
+    echo "❌ $WAREHOUSE_DB is missing."
     exit 1
 fi
 
-# Check if air_pollution.db exists
-if [ -f "$AIR_POLLUTION_DB" ]; then
-    echo "✅ $AIR_POLLUTION_DB exists."
+# Ensure warehouse.db is not empty
+if [ -s "$WAREHOUSE_DB" ]; then
+    echo "✅ $WAREHOUSE_DB is not empty."
 else
-    echo "❌ $AIR_POLLUTION_DB is missing."
+    echo "❌ $WAREHOUSE_DB is empty."
     exit 1
 fi
 
-# Ensure deforestation.db is not empty
-if [ -s "$DEFORESTATION_DB" ]; then
-    echo "✅ $DEFORESTATION_DB is not empty."
-else
-    echo "❌ $DEFORESTATION_DB is empty."
+# Ensure the deforestation and pollution tables hold rows
+for TABLE in deforestation pollution; do
+    ROWS=$(python -c "import sqlite3, sys; print(sqlite3.connect(sys.argv[1]).execute('SELECT COUNT(*) FROM ' + sys.argv[2]).fetchone()[0])" "$WAREHOUSE_DB" "$TABLE")
+    if [ "$ROWS" -gt 0 ] 2>/dev/null; then
+        echo "✅ $TABLE table has $ROWS rows."
+    else
+        echo "❌ $TABLE table is empty."
+        exit 1
+    fi
+done
+
+# A date range that ends before it starts is rejected instead of summed over a negative number of months
+if python -c "import pipeline; pipeline.rollup_range('AffectedArea', '2014-06', '2014-01')" 2>/dev/null; then
+    echo "❌ rollup_range accepted a start after the end."
+    exit 1
+elif python pipeline.py range AffectedArea --start 2014-06 --end 2014-01 2>/dev/null; then
+    echo "❌ The range command accepted --start after --end."
     exit 1
+else
+    echo "✅ Reversed date ranges are rejected."
 fi
 
-# Ensure air_pollution.db is not empty
-if [ -s "$AIR_POLLUTION_DB" ]; then
-    echo "✅ $AIR_POLLUTION_DB is not empty."
+# Download the mock deforestation export from a local stand-in server that drops the connection, resumes and answers 304
+if python mock_download.py --self-test --file "$DATA_DIR/deforestation.csv"; then
+    echo "✅ Downloads resume after a dropped connection and skip unchanged files."
 else
-    echo "❌ $AIR_POLLUTION_DB is empty."
+    echo "❌ Download resume or revalidation failed against the stand-in server."
     exit 1
-fi
\ No newline at end of file
+fi
+
+# Optionally fail on performance regressions against the stored benchmark baseline
+if [ "$RUN_BENCHMARK" = "true" ]; then
+    if python benchmark.py --pipeline --scales small; then
+        echo "✅ No stage regressed past the benchmark baseline."
+    else
+        echo "❌ Pipeline stages regressed past the benchmark baseline or are missing from it."
+        exit 1
+    fi
+fi
+
+# Optionally fetch the mock deforestation export back through a local mock ArcGIS server, as two layers
+if [ "$RUN_ARCGIS_MOCK" = "true" ]; then
+    if python mock_arcgis.py --self-test --csv "$DATA_DIR/deforestation.csv"; then
+        echo "✅ ArcGIS fetcher returned every alert of both mock layers, keyed by layer."
+    else
+        echo "❌ ArcGIS fetcher did not return the mock layers intact."
+        exit 1
+    fi
+fi